@@ -1,19 +1,36 @@
+from async_database import AsyncDatabase
 from database import Database
+from dispatcher import Dispatcher
+from ingest import IngestQueue
+from leaderboard import Leaderboard
+from models import UserEvent, MessageEvent, MentionEvent, ReactionEvent, ReactionRemoveEvent
 from datetime import datetime, timedelta
 from backports.zoneinfo import ZoneInfo
 import discord
 from discord.ext import commands, tasks
-from typing import Set, Dict, List
+from typing import Set, Dict, List, Optional
 import logging
 import random
+import asyncio
 
 logger = logging.getLogger('binky.activity')
 CHANNEL_ID = 801236490524164137 #goal-check-ins
 
 class ActivityTracker:
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, db: Optional[Database] = None, channel_id: int = CHANNEL_ID,
+                 dispatcher: Optional[Dispatcher] = None, async_db: Optional[AsyncDatabase] = None):
         self.bot = bot
-        self.db = Database()
+        self.db = db or Database()
+        # Queries from coroutines go through the pool so they never block the event loop
+        self.async_db = async_db or AsyncDatabase(self.db)
+        # Where weekly winners are announced
+        self.channel_id = channel_id
+        self.dispatcher = dispatcher or Dispatcher()
+        # Handlers only queue events; a writer thread commits them in batches
+        self.ingest = IngestQueue(self.db)
+        # Standings follow committed points; reconciled against the rollup periodically
+        self.leaderboard = Leaderboard(self.db)
+        self.db.add_listener(self.leaderboard.apply)
         # Set of channel IDs that are considered "ranked"
         self.ranked_channels: Set[int] = set()
         
@@ -27,29 +44,22 @@ class ActivityTracker:
         if message.author.bot:
             return
 
-        # Ensure user exists in database
-        self.db.add_user(message.author.id, str(message.author))
-        
-        # Record the message
+        # Ensure user exists in database and record the message
+        now = datetime.utcnow()
         is_ranked = message.channel.id in self.ranked_channels
         logger.info(f"Recording message from {message.author} in channel {message.channel.name} (ranked: {is_ranked})")
-        self.db.record_message(
-            message_id=message.id,
-            user_id=message.author.id,
-            channel_id=message.channel.id,
-            is_ranked=is_ranked,
-            timestamp=datetime.utcnow()
-        )
+        events = [
+            UserEvent(message.author.id, str(message.author)),
+            MessageEvent(message.id, message.author.id, message.channel.id, is_ranked, now),
+        ]
         
         # Process any mentions in the message
         for mention in message.mentions:
             if not mention.bot:  # Ignore bot mentions
-                self.db.add_user(mention.id, str(mention))
-                self.db.record_mention(
-                    message_id=message.id,
-                    mentioned_user_id=mention.id,
-                    timestamp=datetime.utcnow()
-                )
+                events.append(UserEvent(mention.id, str(mention)))
+                events.append(MentionEvent(message.id, mention.id, now))
+
+        self.ingest.put(events)
 
     async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User) -> None:
         """Handle reaction additions."""
@@ -61,69 +71,117 @@ class ActivityTracker:
         if reaction.message.author.bot:
             return
 
-        # Ensure both users exist in database
-        self.db.add_user(user.id, str(user))
-        self.db.add_user(reaction.message.author.id, str(reaction.message.author))
-        
-        # Record the reaction
+        # Ensure both users exist in database and record the reaction
         logger.info(f"Recording reaction from {user} on message by {reaction.message.author}")
-        self.db.record_reaction(
-            message_id=reaction.message.id,
-            reactor_id=user.id,
-            timestamp=datetime.utcnow()
-        )
+        self.ingest.put([
+            UserEvent(user.id, str(user)),
+            UserEvent(reaction.message.author.id, str(reaction.message.author)),
+            ReactionEvent(reaction.message.id, user.id, datetime.utcnow(), reaction.message.channel.id,
+                          str(reaction.emoji)),
+        ])
 
-    @tasks.loop(hours=24)
+    async def on_reaction_remove(self, reaction: discord.Reaction, user: discord.User) -> None:
+        """Handle reaction removals so reaction points and counts stay correct."""
+        if user.bot or reaction.message.author.bot:
+            return
+
+        logger.info(f"Removing reaction from {user} on message by {reaction.message.author}")
+        self.ingest.put([ReactionRemoveEvent(reaction.message.id, user.id, datetime.utcnow(), str(reaction.emoji))])
+
+    @tasks.loop(hours=1)
     async def process_weekly_winner(self) -> None:
-        """Process and announce weekly winner. Runs daily but only takes action on Sundays."""
-        logger.info(f"process_weekly_winner() !!! Day: {datetime.utcnow().weekday()}")
-        if datetime.utcnow().weekday() == 6:  # Sunday
-            scores = self.db.get_weekly_scores()
-            if scores:
-                winner_id, winner_name, score = scores[0]  # Get top scorer
-                logger.info(f"Weekly winner: {winner_name} with score {score:.2f}")
-                logger.info("Top 3 scores: " + ", ".join(f"{name}: {score:.2f}" for _, name, score in scores[:3]))
-                
-                # Record the winner
-                self.db.record_weekly_winner(winner_id, score)
-                
-                # Announce the winner in all ranked channels
-                announcement = (
-                    f"🎉 **Weekly Winner Announcement!** 🎉\n\n"
-                    f"Congratulations to **{winner_name}** for being this week's most active contributor!\n"
-                    f"Score: {score:.2f} points\n\n"
-                    f"Top Contributors:\n"
-                )
-                
-                # Add top 3 to announcement
-                for i, (_, name, user_score) in enumerate(scores[:3], 1):
-                    announcement += f"{i}. {name}: {user_score:.2f} points\n"
-                
-                channel = self.bot.get_channel(CHANNEL_ID)
-                if channel:
-                    await channel.send(announcement)
-                else:
-                    logger.info("Tried to send weekly announcement, but failed to find channel.")
-                
-                # Reset weekly scores
-                self.db.reset_weekly_scores()
+        """Close finished weeks and announce the latest winner.
+
+        Runs hourly and on startup, so weeks that ended while the bot was down
+        are closed on the next run. Closing and announcing are each done once
+        per week; only the most recent closed week is announced.
+        """
+        try:
+            await self._close_and_announce()
+        except asyncio.TimeoutError:
+            # An unhandled error would stop the loop for good
+            logger.warning("Weekly close timed out waiting for the database; retrying next run")
+
+    async def _close_and_announce(self) -> None:
+        loop = asyncio.get_event_loop()
+        closed = await loop.run_in_executor(None, self.db.close_weeks)
+        pending = await self.async_db.get_unannounced_weeks()
+        if not pending:
+            return
+        if closed:
+            # Kept for older tools that read users.weekly_score
+            await loop.run_in_executor(None, self.db.reset_weekly_scores)
+
+        week = pending[-1]
+        if pending[:-1]:
+            logger.info(f"Not announcing {len(pending) - 1} older weeks closed during catch-up")
+        scores = await self.async_db.get_week_snapshot(week, 3)
+        if scores:
+            _, winner_id, winner_name, score = scores[0]
+            logger.info(f"Weekly winner for week of {week}: {winner_name} with score {score:.2f}")
+            logger.info("Top 3 scores: " + ", ".join(f"{name}: {score:.2f}" for _, _, name, score in scores))
+
+            announcement = (
+                f"🎉 **Weekly Winner Announcement!** 🎉\n\n"
+                f"Congratulations to **{winner_name}** for being this week's most active contributor!\n"
+                f"Score: {score:.2f} points\n\n"
+                f"Top Contributors:\n"
+            )
+
+            # Add top 3 to announcement
+            for position, _, name, user_score in scores:
+                announcement += f"{position}. {name}: {user_score:.2f} points\n"
+
+            channel = self.bot.get_channel(self.channel_id)
+            if channel:
+                try:
+                    await self.dispatcher.send(channel, announcement)
+                except Exception:
+                    # Already logged by the dispatcher; announce again on the next run
+                    return
+            else:
+                logger.info("Tried to send weekly announcement, but failed to find channel.")
+        await loop.run_in_executor(None, self.db.mark_weeks_announced, pending)
+
+    @tasks.loop(minutes=10)
+    async def reconcile_leaderboard(self) -> None:
+        """Resync the in-memory leaderboard with the database."""
+        await asyncio.get_event_loop().run_in_executor(None, self.leaderboard.reconcile)
+
+    @tasks.loop(hours=24)
+    async def compact_history(self) -> None:
+        """Compact raw activity older than the retention window into daily totals."""
+        await asyncio.get_event_loop().run_in_executor(None, self.db.compact_activity)
 
     def start_tasks(self) -> None:
         """Start background tasks."""
+        self.ingest.start()
+        if not self.db.epoch_timestamps:
+            # Convert legacy timestamps off the event loop; queries keep working meanwhile
+            asyncio.get_event_loop().run_in_executor(None, self.db.migrate_timestamps)
         self.process_weekly_winner.start()
+        self.reconcile_leaderboard.start()
+        self.compact_history.start()
 
     def cog_unload(self) -> None:
         """Clean up tasks when cog is unloaded."""
         self.process_weekly_winner.cancel()
+        self.reconcile_leaderboard.cancel()
+        self.compact_history.cancel()
+        self.ingest.close()
 
 
 class PingManager:
-    def __init__(self, db: Database, bot: commands.Bot, channel_id: int):
+    def __init__(self, db: Database, bot: commands.Bot, channel_id: int, dispatcher: Optional[Dispatcher] = None,
+                 async_db: Optional[AsyncDatabase] = None):
         self.db = db
+        self.async_db = async_db or AsyncDatabase(db)
         self.bot = bot
         self.channel_id = channel_id
+        self.dispatcher = dispatcher or Dispatcher()
         self.questions = self._load_questions()
         self.tz = ZoneInfo('America/Los_Angeles')
+        self._ping_lock = asyncio.Lock()
     
     def _load_questions(self) -> List[str]:
         """Load questions from questions.txt."""
@@ -141,39 +199,56 @@ class PingManager:
             return
             
         # Check last activity
-        last_activity = self.db.get_last_activity_time()
+        last_activity = await self.async_db.get_last_activity_time()
         if not last_activity or datetime.utcnow() - last_activity < timedelta(hours=14):
             return
             
         # Check last ping
-        last_ping = self.db.get_last_ping_time()
+        last_ping = await self.async_db.get_last_ping_time()
         if last_ping and datetime.utcnow() - last_ping < timedelta(days=7):
             return
             
-        # Get candidate members
-        candidates = self.db.get_pingable_members()
-        if not candidates:
-            return
-            
-        # Select from top 5 (or fewer if less available)
-        top_candidates = candidates[:5]
-        selected = random.choice(top_candidates)
-        
-        await self.ping_member(selected[0], selected[1])
-    
-    async def ping_member(self, user_id: int, username: str, forced: bool = False) -> None:
-        """Ping a specific member with a random question."""
+        await self.ping_candidate()
+
+    async def ping_candidate(self, forced: bool = False) -> bool:
+        """Ping one of the top 5 pingable members. Returns False if nobody is eligible or the ping failed.
+
+        Calls run one at a time, so two overlapping calls can't pick the same
+        member before the first ping is recorded.
+        """
+        async with self._ping_lock:
+            candidates = await self.async_db.get_pingable_members(limit=5)
+            if not candidates:
+                return False
+            selected = random.choice(candidates)
+            return await self.ping_member(selected[0], selected[1], forced)
+
+    async def ping_member(self, user_id: int, username: str, forced: bool = False) -> bool:
+        """Ping a specific member with a random question. Returns whether the ping was delivered."""
         question = random.choice(self.questions)
         channel = self.bot.get_channel(self.channel_id)
-        
-        if channel:
-            await channel.send(f"<@{user_id}>, {question}")
-            self.db.record_ping(user_id, question, forced)
+        if not channel:
+            return False
+        try:
+            await self.dispatcher.send(channel, f"<@{user_id}>, {question}")
+        except Exception:
+            # The dispatcher has logged it; only pings that reached the channel count towards the interval
+            return False
+        try:
+            # A write, so AsyncDatabase runs it to the end rather than abandoning it
+            await self.async_db.record_ping(user_id, question, forced)
+        except Exception:
+            logger.exception(f"Pinged {username} but failed to record the ping")
+        return True
     
     @tasks.loop(hours=1)
     async def ping_check_loop(self) -> None:
         """Regular check for inactivity."""
-        await self.check_and_ping()
+        try:
+            await self.check_and_ping()
+        except asyncio.TimeoutError:
+            # An unhandled error would stop the loop for good
+            logger.warning("Inactivity check timed out waiting for the database; retrying next run")
     
     def start(self) -> None:
         """Start the ping check loop."""
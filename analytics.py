@@ -0,0 +1,160 @@
+"""Columnar analytics over the whole activity history.
+
+Every scored action, raw and compacted, is loaded into parallel NumPy arrays
+(user index, channel index, epoch ms, points, ranked flag) sorted by time, so a
+window is a slice found by binary search and a leaderboard is a bincount over
+it. NumPy is optional: without it AVAILABLE is False and binky!leaderboard is
+disabled.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from database import Database, to_epoch_ms
+from scoring import SCORE_EPSILON
+
+logger = logging.getLogger('binky.analytics')
+
+AVAILABLE = np is not None
+
+# Named windows in days; None is all time
+WINDOWS: Dict[str, Optional[int]] = {'week': 7, 'month': 30, 'year': 365, 'all': None}
+
+
+def parse_window(text: str) -> Optional[int]:
+    """Days covered by a window name (week, month, year, all) or a count such as 14d."""
+    text = text.lower()
+    if text in WINDOWS:
+        return WINDOWS[text]
+    if text.endswith('d') and text[:-1].isdigit() and int(text[:-1]) > 0:
+        return int(text[:-1])
+    raise ValueError(f"Unknown window: {text}")
+
+
+class AnalyticsEngine:
+    """Leaderboards for any window, channel or ranked/social split.
+
+    The arrays are reloaded from the database once they are older than max_age
+    seconds; per-user totals are cached by (window start, channel, ranked) until
+    the next reload.
+    """
+
+    def __init__(self, db: Database, max_age: float = 300.0, chunk_size: int = 50000):
+        if not AVAILABLE:
+            raise RuntimeError("AnalyticsEngine needs numpy")
+        self.db = db
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._cache: Dict[Tuple, "np.ndarray"] = {}
+        self._names: Dict[int, str] = {}
+        self._user_ids = self._channel_ids = None
+        self._user = self._channel = self._epoch = self._points = self._ranked = None
+
+    def refresh(self, force: bool = False) -> None:
+        """Reload the arrays if they are stale (or always, with force)."""
+        with self._lock:
+            if force or self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+                self._load()
+
+    def _load(self) -> None:
+        """Read all activity in chunks into time-sorted columns. Caller holds the lock."""
+        started = time.perf_counter()
+        dtype = [('user', 'i8'), ('channel', 'i8'), ('epoch', 'i8'), ('points', 'f8'), ('ranked', '?')]
+        chunks = [np.array(rows, dtype=dtype) for rows in self.db.iter_activity(self.chunk_size)]
+        table = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+        table = table[np.argsort(table['epoch'], kind='stable')]
+
+        # Dense indexes keep bincount outputs as small as the number of users/channels
+        self._user_ids, user = np.unique(table['user'], return_inverse=True)
+        self._channel_ids, channel = np.unique(table['channel'], return_inverse=True)
+        self._user = user.astype(np.int32)
+        self._channel = channel.astype(np.int32)
+        self._epoch = np.ascontiguousarray(table['epoch'])
+        self._points = np.ascontiguousarray(table['points'])
+        self._ranked = np.ascontiguousarray(table['ranked'])
+        self._names = self.db.get_usernames()
+        self._cache.clear()
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(table)} actions for {len(self._user_ids)} users "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    def _window_start(self, days: Optional[int]) -> int:
+        """First epoch ms of a window of UTC days ending today; 0 for all time."""
+        if days is None:
+            return 0
+        start = datetime.utcnow().date() - timedelta(days=days - 1)
+        return to_epoch_ms(datetime.combine(start, datetime.min.time()))
+
+    def _totals(self, days: Optional[int], channel_id: Optional[int], ranked: Optional[bool]) -> "np.ndarray":
+        """Points per user index over a window. Caller holds the lock."""
+        start = self._window_start(days)
+        key = (start, channel_id, ranked)
+        totals = self._cache.get(key)
+        if totals is not None:
+            return totals
+
+        first = np.searchsorted(self._epoch, start, side='left')
+        user, points = self._user[first:], self._points[first:]
+        mask = None
+        if channel_id is not None:
+            i = np.searchsorted(self._channel_ids, channel_id)
+            found = i < len(self._channel_ids) and self._channel_ids[i] == channel_id
+            mask = self._channel[first:] == i if found else np.zeros(len(user), dtype=bool)
+        if ranked is not None:
+            ranked_mask = self._ranked[first:] == ranked
+            mask = ranked_mask if mask is None else mask & ranked_mask
+        if mask is not None:
+            user, points = user[mask], points[mask]
+
+        totals = np.bincount(user, weights=points, minlength=len(self._user_ids))
+        self._cache[key] = totals
+        return totals
+
+    def leaderboard(self, days: Optional[int] = 7, channel_id: Optional[int] = None,
+                    ranked: Optional[bool] = None, limit: int = 10) -> List[Tuple[int, str, float]]:
+        """Top scorers as (user_id, username, score) over the last days UTC days."""
+        self.refresh()
+        with self._lock:
+            totals = self._totals(days, channel_id, ranked)
+            scored = np.flatnonzero(totals > SCORE_EPSILON)
+            if len(scored) > limit:
+                scored = scored[np.argpartition(-totals[scored], limit - 1)[:limit]]
+            order = scored[np.lexsort((self._user_ids[scored], -totals[scored]))]
+            return [(int(self._user_ids[i]), self._names.get(int(self._user_ids[i]), str(self._user_ids[i])),
+                     float(totals[i])) for i in order]
+
+    def rank(self, user_id: int, days: Optional[int] = 7, channel_id: Optional[int] = None,
+             ranked: Optional[bool] = None) -> Optional[Tuple[int, float, int]]:
+        """(rank, score, ranked users) for a user, or None if they have no points. Ties share a rank."""
+        self.refresh()
+        with self._lock:
+            i = np.searchsorted(self._user_ids, user_id)
+            if i >= len(self._user_ids) or self._user_ids[i] != user_id:
+                return None
+            totals = self._totals(days, channel_id, ranked)
+            score = float(totals[i])
+            if score <= SCORE_EPSILON:
+                return None
+            return int((totals > score).sum()) + 1, score, int((totals > SCORE_EPSILON).sum())
+
+    def channel_totals(self, days: Optional[int] = 7, ranked: Optional[bool] = None) -> List[Tuple[int, float]]:
+        """Points per channel as (channel_id, points), highest first."""
+        self.refresh()
+        with self._lock:
+            first = np.searchsorted(self._epoch, self._window_start(days), side='left')
+            channel, points = self._channel[first:], self._points[first:]
+            if ranked is not None:
+                mask = self._ranked[first:] == ranked
+                channel, points = channel[mask], points[mask]
+            totals = np.bincount(channel, weights=points, minlength=len(self._channel_ids))
+            order = np.argsort(-totals, kind='stable')
+            return [(int(self._channel_ids[i]), float(totals[i])) for i in order if totals[i] > SCORE_EPSILON]
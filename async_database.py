@@ -0,0 +1,148 @@
+"""Awaitable Database queries that keep SQLite off the event loop.
+
+AsyncDatabase runs Database methods on a small thread pool. Its workers share
+the database's reader pool with long reads on other threads (exports, analytics
+loads, weekly closes), so the pool is grown by the number of workers; a query
+can still wait for a connection, and that wait counts towards its timeout.
+get_* queries that are already running are shared: several people
+running binky!standings at once cost one query. A caller of a get_* query that
+times out or is cancelled stops waiting; once nobody is waiting the query is
+interrupted. Anything else may write, so it always runs to completion and its
+callers wait for it without a timeout.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from database import Database
+from metrics import REGISTRY
+
+logger = logging.getLogger('binky.async_database')
+
+# Seconds a caller waits for a query by default
+QUERY_TIMEOUT = 10.0
+
+READS_COALESCED = REGISTRY.counter('binky_db_reads_coalesced', "Queries that joined an identical running query.")
+READS_TIMED_OUT = REGISTRY.counter('binky_db_reads_timed_out', "Queries a caller gave up waiting for.")
+
+
+class _Query:
+    """One execution on the pool and the callers waiting for it."""
+
+    def __init__(self, key: Optional[Tuple]):
+        self.key = key
+        self.future: Optional[asyncio.Future] = None
+        self.waiters = 0
+        self.thread_id: Optional[int] = None
+        self.abandoned = False
+
+
+class AsyncDatabase:
+    """Run Database methods on a thread pool: await adb.get_scores(start) instead of db.get_scores(start).
+
+    Only read-only get_* methods are shared between identical concurrent calls,
+    time out and can be abandoned; anything else runs once per call and is never
+    dropped. Writes still serialize on the database's write lock.
+    """
+
+    def __init__(self, db: Database, max_workers: Optional[int] = None, timeout: float = QUERY_TIMEOUT):
+        self.db = db
+        self.timeout = timeout
+        name = f"binky-db-{db.guild_id}" if db.guild_id is not None else 'binky-db'
+        workers = max_workers or db.max_readers
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        # Room in the shared reader pool for every worker on top of the other readers
+        db.max_readers += workers
+        self._running: Dict[Tuple, _Query] = {}
+        # Guards _Query.thread_id and abandoned between the pool threads and the event loop
+        self._lock = threading.Lock()
+        self.pending = 0
+        REGISTRY.gauge('binky_db_queries_pending', "Queries running or queued on the query pool.",
+                       lambda: self.pending, 'guild', db.metrics_label)
+
+    def __getattr__(self, name: str) -> Callable:
+        method = getattr(self.db, name)
+        if name.startswith('_') or not callable(method):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.call(name, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    async def call(self, name: str, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run db.name(*args, **kwargs) on the pool and wait for it.
+
+        get_* queries wait at most timeout seconds and raise asyncio.TimeoutError;
+        the query is interrupted if no other caller is still waiting for it.
+        Other methods are waited for without a timeout and always run to the
+        end, even if the caller is cancelled.
+        """
+        read_only = name.startswith('get_')
+        key = (name, args, tuple(sorted(kwargs.items()))) if read_only else None
+        query = self._running.get(key) if key is not None else None
+        if query is None:
+            query = _Query(key)
+            query.future = asyncio.get_event_loop().run_in_executor(
+                self._executor, self._run, query, getattr(self.db, name), args, kwargs)
+            self.pending += 1
+            query.future.add_done_callback(self._done)
+            if key is not None:
+                self._running[key] = query
+                query.future.add_done_callback(lambda _: self._forget(query))
+        else:
+            READS_COALESCED.labels().inc()
+
+        if not read_only:
+            # Shielded, so a cancelled caller doesn't cancel a queued write
+            return await asyncio.shield(query.future)
+
+        query.waiters += 1
+        try:
+            # Shielded, so one caller giving up doesn't cancel the query for the others
+            return await asyncio.wait_for(asyncio.shield(query.future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            READS_TIMED_OUT.labels().inc()
+            logger.warning(f"Gave up on {name} after {timeout or self.timeout}s")
+            raise
+        finally:
+            query.waiters -= 1
+            if not query.waiters and not query.future.done():
+                self._abandon(query)
+
+    def _run(self, query: _Query, method: Callable, args: Tuple, kwargs: Dict) -> Any:
+        """Pool thread: run the method unless every caller already gave up."""
+        with self._lock:
+            if query.abandoned:
+                return None
+            query.thread_id = threading.get_ident()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            with self._lock:
+                query.thread_id = None
+
+    def _abandon(self, query: _Query) -> None:
+        """Nobody is waiting any more: drop the query, or interrupt it if it's running."""
+        self._forget(query)
+        # Under the lock the thread can't finish this query and start another
+        # before the interrupt, so only this query's read is interrupted
+        with self._lock:
+            query.abandoned = True
+            if query.thread_id is not None and self.db.interrupt_reads(query.thread_id):
+                logger.info("Interrupted an abandoned query")
+        # Consume the outcome so an interrupted query doesn't log "exception never retrieved"
+        query.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def _done(self, future: asyncio.Future) -> None:
+        self.pending -= 1
+
+    def _forget(self, query: _Query) -> None:
+        if query.key is not None and self._running.get(query.key) is query:
+            del self._running[query.key]
+
+    def close(self) -> None:
+        """Wait for running queries and stop the pool."""
+        self._executor.shutdown(wait=True)
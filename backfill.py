@@ -0,0 +1,157 @@
+"""Resumable backfill of channel history into the database.
+
+Streams each channel's history oldest-first through a small generator pipeline
+(fetch -> normalize -> batch) and writes every batch together with a per-channel
+checkpoint, so an interrupted run picks up after the last stored batch.
+
+Usage:
+    python backfill.py [--db binky_bot.db] [--days N] [--social] CHANNEL_ID [CHANNEL_ID ...]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterable, List, Optional, Set, Tuple
+
+import discord
+
+from database import Database
+from models import Event, UserEvent, MessageEvent, MentionEvent, ReactionEvent
+
+logger = logging.getLogger('binky.backfill')
+
+BATCH_SIZE = 1000
+
+# One history message as (message_id, events); bot messages carry no events
+Normalized = Tuple[int, List[Event]]
+
+
+def _utc(dt: datetime) -> datetime:
+    """Convert a discord timestamp to the naive UTC datetimes the database uses."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+async def normalize(history: AsyncIterator, is_ranked: bool,
+                    include_reactions: bool = True) -> AsyncIterator[Normalized]:
+    """Turn history messages into the same events the live handlers produce."""
+    async for message in history:
+        if message.author.bot:
+            yield message.id, []
+            continue
+
+        timestamp = _utc(message.created_at)
+        events: List[Event] = [
+            UserEvent(message.author.id, str(message.author)),
+            MessageEvent(message.id, message.author.id, message.channel.id, is_ranked, timestamp),
+        ]
+        for mention in message.mentions:
+            if not mention.bot:
+                events.append(UserEvent(mention.id, str(mention)))
+                events.append(MentionEvent(message.id, mention.id, timestamp))
+
+        if include_reactions:
+            # Reaction times aren't exposed by the API; use the message time
+            for reaction in message.reactions:
+                async for user in reaction.users():
+                    if not user.bot:
+                        events.append(UserEvent(user.id, str(user)))
+                        events.append(ReactionEvent(message.id, user.id, timestamp, message.channel.id,
+                                                    str(reaction.emoji)))
+        yield message.id, events
+
+
+async def batched(items: AsyncIterator[Normalized], size: int) -> AsyncIterator[List[Normalized]]:
+    """Group an async stream into lists of at most size items."""
+    batch: List[Normalized] = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def backfill_channel(db: Database, channel, is_ranked: bool, since: Optional[datetime] = None,
+                           batch_size: int = BATCH_SIZE, include_reactions: bool = True) -> int:
+    """Backfill one channel from its checkpoint. Returns messages written.
+
+    On a first run history starts at since if given, otherwise after the newest
+    message live ingest stored for the channel (which doesn't checkpoint), so
+    only channels with nothing stored are read from the beginning. A failed
+    fetch stops the channel early; what was written so far still counts.
+    """
+    checkpoint = db.get_backfill_checkpoint(channel.id)
+    if not checkpoint and since is None:
+        checkpoint = db.get_newest_message_id(channel.id)
+    after = discord.Object(id=checkpoint) if checkpoint else since
+    history = channel.history(limit=None, after=after, oldest_first=True)
+
+    loop = asyncio.get_event_loop()
+    written = 0
+    try:
+        async for batch in batched(normalize(history, is_ranked, include_reactions), batch_size):
+            # Write off the event loop; the checkpoint advances with each batch
+            written += await loop.run_in_executor(None, db.record_backfill_batch, channel.id, batch)
+            logger.info(f"Backfilled {written} messages from #{channel} (through {batch[-1][0]})")
+    except discord.HTTPException:
+        # Missing permissions and similar: the checkpoint keeps what was done so far
+        logger.exception(f"Backfill of #{channel} stopped early after {written} messages")
+    return written
+
+
+async def backfill_channels(db: Database, channels: Iterable, ranked_channels: Set[int],
+                            since: Optional[datetime] = None, **kwargs) -> int:
+    """Backfill several channels one after another. Returns messages written."""
+    total = 0
+    for channel in channels:
+        total += await backfill_channel(db, channel, channel.id in ranked_channels, since, **kwargs)
+    if total:
+        # Each channel replays history from the start, so days arrived out of order
+        await asyncio.get_event_loop().run_in_executor(None, db.recompute_streaks)
+    return total
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Backfill channel history into the Binky database")
+    parser.add_argument('channel_ids', nargs='+', type=int, help="channels to backfill")
+    parser.add_argument('--db', default='binky_bot.db', help="path to the SQLite database")
+    parser.add_argument('--days', type=int, help="on a first run, fetch this many days of history "
+                             "(default: everything after the newest stored message)")
+    parser.add_argument('--social', action='store_true', help="score the channels as social, not ranked")
+    args = parser.parse_args()
+
+    load_dotenv()
+    since = datetime.now(timezone.utc) - timedelta(days=args.days) if args.days else None
+    ranked = set() if args.social else set(args.channel_ids)
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.members = True
+    client = discord.Client(intents=intents)
+    db = Database(args.db)
+
+    @client.event
+    async def on_ready():
+        try:
+            channels = [client.get_channel(channel_id) for channel_id in args.channel_ids]
+            total = await backfill_channels(db, [c for c in channels if c], ranked, since)
+            logger.info(f"Backfill complete: {total} messages written")
+        finally:
+            await client.close()
+
+    client.run(os.getenv('BINKY_BOT_TOKEN'))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Benchmark Database and ActivityTracker against a synthetic workload.
+
+Run from the repository root:
+    python -m benchmarks.run [--users 200] [--weeks 4] [--live 20000] [--json]
+    python -m benchmarks.run --json > before.json   # then, on another commit:
+    python -m benchmarks.run --compare before.json [--threshold 0.25]
+
+Phases:
+  seed    weeks of history written in bulk with Database.record_batch
+  direct  single-event record_message / record_reaction calls
+  live    the real ActivityTracker handlers fed stub discord objects, timed per
+          call and end to end until the ingest queue is flushed
+  queries standings and ping candidate queries against the seeded database,
+          and opening the (already migrated) database
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import analytics
+from activity_tracker import ActivityTracker
+from benchmarks.stubs import StubBot
+from benchmarks.workload import Workload
+from database import Database
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p99/max of latency samples, in milliseconds."""
+    if not samples:
+        return {'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0, 'count': 0}
+    ordered = sorted(samples)
+    return {
+        'p50_ms': round(statistics.median(ordered) * 1000, 4),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+        'count': len(ordered),
+    }
+
+
+def timed(fn: Callable, repeat: int) -> Dict[str, float]:
+    """Call fn repeatedly and summarize its latency."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def seed(db: Database, workload: Workload, weeks: int, batch_size: int = 5000) -> Dict[str, float]:
+    """Write weeks of history in bulk batches."""
+    start = datetime.utcnow() - timedelta(weeks=weeks)
+    batch, events = [], 0
+    began = time.perf_counter()
+    for item in workload.items(start, weeks * 7):
+        batch.extend(workload.to_events(item))
+        if len(batch) >= batch_size:
+            db.record_batch(batch)
+            events += len(batch)
+            batch = []
+    if batch:
+        db.record_batch(batch)
+        events += len(batch)
+    elapsed = time.perf_counter() - began
+    return {'events': events, 'seconds': round(elapsed, 3), 'events_per_sec': round(events / elapsed, 1)}
+
+
+def direct(db: Database, workload: Workload, count: int) -> Dict[str, Dict[str, float]]:
+    """Time single-event Database writes, the pre-queue ingest path."""
+    messages, reactions = [], []
+    for item in workload.items(datetime.utcnow(), count / workload.messages_per_day):
+        if item[0] == 'message':
+            m = item[1]
+            db.add_user(m.author.id, str(m.author))
+            start = time.perf_counter()
+            db.record_message(m.id, m.author.id, m.channel.id, m.channel.id in workload.ranked_channels,
+                              datetime.utcnow())
+            messages.append(time.perf_counter() - start)
+        else:
+            reaction, user = item[1], item[2]
+            db.add_user(user.id, str(user))
+            start = time.perf_counter()
+            db.record_reaction(reaction.message.id, user.id, datetime.utcnow(), reaction.emoji)
+            reactions.append(time.perf_counter() - start)
+    return {'record_message': percentiles(messages), 'record_reaction': percentiles(reactions)}
+
+
+async def live(tracker: ActivityTracker, workload: Workload, count: int) -> Dict[str, object]:
+    """Drive the tracker handlers and wait for the writer to catch up."""
+    latencies: Dict[str, List[float]] = {'message': [], 'reaction': []}
+    items = 0
+    began = time.perf_counter()
+    for item in workload.items(datetime.utcnow(), count / workload.messages_per_day):
+        start = time.perf_counter()
+        if item[0] == 'message':
+            await tracker.on_message(item[1])
+        else:
+            await tracker.on_reaction_add(item[1], item[2])
+        latencies[item[0]].append(time.perf_counter() - start)
+        items += 1
+    handler_seconds = time.perf_counter() - began
+    tracker.ingest.close()
+    total_seconds = time.perf_counter() - began
+    return {
+        'gateway_events': items,
+        'handler_seconds': round(handler_seconds, 3),
+        'flushed_seconds': round(total_seconds, 3),
+        'events_per_sec': round(items / total_seconds, 1),
+        'dropped': tracker.ingest.dropped,
+        'on_message': percentiles(latencies['message']),
+        'on_reaction_add': percentiles(latencies['reaction']),
+    }
+
+
+def queries(db: Database, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Time the read paths behind binky!standings, binky!ping, binky!debug and binky!leaderboard, and startup."""
+    results = {
+        'open_database': timed(lambda: Database(db.db_path).close(), repeat),
+        'get_weekly_scores': timed(db.get_weekly_scores, repeat),
+        'get_pingable_members': timed(lambda: db.get_pingable_members(limit=5), repeat),
+        'get_recent_activity': timed(db.get_recent_activity, repeat),
+        'get_last_activity_time': timed(db.get_last_activity_time, repeat),
+    }
+    if analytics.AVAILABLE:
+        engine = analytics.AnalyticsEngine(db)
+        results['analytics_load'] = timed(lambda: engine.refresh(force=True), max(1, repeat // 10))
+        # A different window every run so totals are computed, not served from cache
+        windows = itertools.count(2)
+        results['analytics_leaderboard'] = timed(lambda: engine.leaderboard(next(windows)), repeat)
+    return results
+
+
+def db_size(path: str) -> int:
+    """Database size in bytes, including the WAL."""
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def run(args: argparse.Namespace) -> Dict[str, object]:
+    workload = Workload(users=args.users, channels=args.channels,
+                        messages_per_day=args.messages_per_day, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = Database(path)
+        results: Dict[str, object] = {
+            'config': vars(args),
+            'seed': seed(db, workload, args.weeks),
+            'direct': direct(db, workload, args.direct),
+        }
+
+        tracker = ActivityTracker(StubBot(workload.channels), db=db)
+        tracker.set_ranked_channels(list(workload.ranked_channels))
+        tracker.ingest.start()
+        results['live'] = asyncio.run(live(tracker, workload, args.live))
+        results['queries'] = queries(db, args.repeat)
+        results['db_bytes'] = db_size(path)
+        db.close()
+    return results
+
+
+def print_report(results: Dict[str, object]) -> None:
+    seeded, live_results = results['seed'], results['live']
+    print(f"seed:    {seeded['events']} events in {seeded['seconds']}s ({seeded['events_per_sec']}/s)")
+    for name, stats in results['direct'].items():
+        print(f"direct:  {name:<24} p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms")
+    print(f"live:    {live_results['gateway_events']} gateway events, {live_results['events_per_sec']}/s "
+          f"flushed, {live_results['dropped']} dropped")
+    for name in ('on_message', 'on_reaction_add'):
+        stats = live_results[name]
+        print(f"live:    {name:<24} p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms")
+    for name, stats in results['queries'].items():
+        print(f"query:   {name:<24} p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms")
+    print(f"db size: {results['db_bytes'] / 1024 / 1024:.1f} MiB")
+
+
+def flatten(results: Dict[str, object], prefix: str = '') -> Dict[str, float]:
+    """Flatten nested results to {'live.on_message.p99_ms': value}."""
+    flat: Dict[str, float] = {}
+    for key, value in results.items():
+        if key == 'config':
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline: Dict[str, object], results: Dict[str, object], threshold: float) -> List[str]:
+    """List latencies that got slower than the baseline by more than threshold."""
+    before, after = flatten(baseline), flatten(results)
+    regressions = []
+    for name, old in sorted(before.items()):
+        new = after.get(name)
+        if name.endswith('_ms') and new is not None and old > 0 and (new - old) / old > threshold:
+            regressions.append(f"{name}: {old:.3f} -> {new:.3f} ms (+{(new - old) / old:.0%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Binky ingest and query benchmarks")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--weeks', type=int, default=4, help="weeks of seeded history")
+    parser.add_argument('--messages-per-day', type=int, default=2000)
+    parser.add_argument('--direct', type=int, default=2000, help="single-event writes to time")
+    parser.add_argument('--live', type=int, default=20000, help="messages to push through the handlers")
+    parser.add_argument('--repeat', type=int, default=50, help="runs per query")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    parser.add_argument('--compare', help="baseline JSON from an earlier --json run")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="relative latency increase reported as a regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Minimal stand-ins for the discord objects ActivityTracker and backfill read."""
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+
+class StubUser:
+    def __init__(self, user_id: int, name: str, bot: bool = False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class StubGuild:
+    def __init__(self, guild_id: int, name: str = 'guild'):
+        self.id = guild_id
+        self.name = name
+
+
+class StubHTTPError(Exception):
+    """Stands in for discord.HTTPException; status 429 is a rate limit."""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"{status} response")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class StubChannel:
+    """Records what is sent to it and serves messages as history.
+
+    With rate_limit=(messages, seconds) a send beyond that many in the last
+    seconds raises a 429 StubHTTPError, like Discord; failures are raised by
+    the next sends, in order. history() serves the messages list; with
+    history_error=(n, error) it raises error after yielding n messages.
+    """
+
+    def __init__(self, channel_id: int, name: str, guild: Optional[StubGuild] = None,
+                 rate_limit: Optional[Tuple[int, float]] = None, failures: Optional[List[Exception]] = None,
+                 history_error: Optional[Tuple[int, Exception]] = None):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.rate_limit = rate_limit
+        self.failures = list(failures or [])
+        self.sent: List[Tuple[float, str]] = []
+        self.rejected = 0
+        self.messages: List['StubMessage'] = []
+        self.history_error = history_error
+        self.fetched = 0
+
+    async def send(self, content: str) -> str:
+        now = time.monotonic()
+        if self.failures:
+            self.rejected += 1
+            raise self.failures.pop(0)
+        if self.rate_limit:
+            limit, period = self.rate_limit
+            recent = [at for at, _ in self.sent[-limit:] if now - at < period]
+            if len(recent) >= limit:
+                self.rejected += 1
+                raise StubHTTPError(429, retry_after=period - (now - recent[0]))
+        self.sent.append((now, content))
+        return content
+
+    async def history(self, limit: Optional[int] = None, after=None,
+                      oldest_first: bool = True) -> AsyncIterator['StubMessage']:
+        """Like TextChannel.history: after is anything with an id (a message or checkpoint) or a datetime."""
+        messages = sorted(self.messages, key=lambda m: m.id, reverse=not oldest_first)
+        if after is not None and hasattr(after, 'id'):
+            messages = [m for m in messages if m.id > after.id]
+        elif after is not None:
+            messages = [m for m in messages if _aware(m.created_at) > _aware(after)]
+        for yielded, message in enumerate(messages[:limit]):
+            if self.history_error and yielded >= self.history_error[0]:
+                raise self.history_error[1]
+            self.fetched += 1
+            yield message
+
+    def __str__(self) -> str:
+        return self.name
+
+
+def _aware(dt: datetime) -> datetime:
+    """Naive stub timestamps are UTC, like the database's."""
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+class StubMessage:
+    def __init__(self, message_id: int, author: StubUser, channel: StubChannel,
+                 created_at: datetime, mentions: Optional[List[StubUser]] = None):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.created_at = created_at
+        self.mentions = mentions or []
+        self.reactions: List['StubReaction'] = []
+
+    @property
+    def guild(self) -> Optional[StubGuild]:
+        return self.channel.guild
+
+    def react(self, user: StubUser, emoji: str = '👍') -> 'StubReaction':
+        """Add user's reaction with emoji, grouped per emoji like discord.Message.reactions."""
+        reaction = next((r for r in self.reactions if r.emoji == emoji), None)
+        if reaction is None:
+            reaction = StubReaction(self, emoji)
+            self.reactions.append(reaction)
+        reaction.reactors.append(user)
+        return reaction
+
+
+class StubReaction:
+    def __init__(self, message: StubMessage, emoji: str = '👍'):
+        self.message = message
+        self.emoji = emoji
+        self.reactors: List[StubUser] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.reactors)
+
+    async def users(self) -> AsyncIterator[StubUser]:
+        for user in list(self.reactors):
+            yield user
+
+
+class StubBot:
+    """Just enough of commands.Bot for the tracker's background tasks."""
+
+    def __init__(self, channels: List[StubChannel]):
+        self._channels = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id: int) -> Optional[StubChannel]:
+        return self._channels.get(channel_id)
@@ -0,0 +1,92 @@
+"""Seeded synthetic activity for benchmarking.
+
+Users and channels get skewed (Zipf-like) activity weights, reactions land on
+recent messages and a few users react more than once, so the workload exercises
+the same hot paths as a busy server.
+"""
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List, Set, Tuple
+
+from benchmarks.stubs import StubChannel, StubMessage, StubUser
+from models import Event, UserEvent, MessageEvent, MentionEvent, ReactionEvent
+
+# ('message', message) or ('reaction', reaction, user)
+Item = Tuple
+
+# A user reacting more than once to a message uses a different emoji each time, as on Discord
+EMOJIS = ('👍', '🔥', '❤️', '😂', '🎉', '👀')
+
+
+class Workload:
+    def __init__(self, users: int = 200, channels: int = 20, ranked_fraction: float = 0.5,
+                 messages_per_day: int = 2000, reactions_per_message: float = 1.5,
+                 mentions_per_message: float = 0.2, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.users = [StubUser(10_000 + i, f"user{i}") for i in range(users)]
+        self.channels = [StubChannel(20_000 + i, f"channel-{i}") for i in range(channels)]
+        self.ranked_channels: Set[int] = {c.id for c in self.channels[:int(channels * ranked_fraction)]}
+        self.messages_per_day = messages_per_day
+        self.reactions_per_message = reactions_per_message
+        self.mentions_per_message = mentions_per_message
+        self._user_weights = [1 / (rank + 1) ** 1.1 for rank in range(users)]
+        self._channel_weights = [1 / (rank + 1) for rank in range(channels)]
+        self._next_message_id = 1_000_000
+        self._recent: List[StubMessage] = []
+
+    def _user(self) -> StubUser:
+        return self.rng.choices(self.users, self._user_weights)[0]
+
+    def items(self, start: datetime, days: float) -> Iterator[Item]:
+        """Yield messages and reactions in time order from start for the given days."""
+        count = int(self.messages_per_day * days)
+        step = timedelta(days=days) / max(count, 1)
+        for i in range(count):
+            now = start + step * i
+            author = self._user()
+            channel = self.rng.choices(self.channels, self._channel_weights)[0]
+            mentions = {u.id: u for u in (self._user() for _ in range(self._poisson(self.mentions_per_message)))}
+            message = StubMessage(self._next_message_id, author, channel, now,
+                                  [u for u in mentions.values() if u.id != author.id])
+            self._next_message_id += 1
+            self._recent = (self._recent + [message])[-50:]
+            yield ('message', message)
+
+            for _ in range(self._poisson(self.reactions_per_message)):
+                target = self.rng.choice(self._recent)
+                reactor = self._user()
+                if reactor.id != target.author.id:
+                    reacted = sum(reactor in r.reactors for r in target.reactions)
+                    yield ('reaction', target.react(reactor, EMOJIS[reacted % len(EMOJIS)]), reactor)
+
+    def _poisson(self, mean: float) -> int:
+        # Knuth's method; means here are small
+        limit, k, p = math.exp(-mean), 0, 1.0
+        while True:
+            p *= self.rng.random()
+            if p <= limit:
+                return k
+            k += 1
+
+    def to_events(self, item: Item) -> List[Event]:
+        """Convert a workload item to the events the tracker would queue for it."""
+        if item[0] == 'message':
+            message = item[1]
+            ranked = message.channel.id in self.ranked_channels
+            events: List[Event] = [
+                UserEvent(message.author.id, str(message.author)),
+                MessageEvent(message.id, message.author.id, message.channel.id, ranked, message.created_at),
+            ]
+            for mention in message.mentions:
+                events.append(UserEvent(mention.id, str(mention)))
+                events.append(MentionEvent(message.id, mention.id, message.created_at))
+            return events
+
+        reaction, user = item[1], item[2]
+        return [
+            UserEvent(user.id, str(user)),
+            UserEvent(reaction.message.author.id, str(reaction.message.author)),
+            ReactionEvent(reaction.message.id, user.id, reaction.message.created_at, reaction.message.channel.id,
+                          reaction.emoji),
+        ]
@@ -4,10 +4,19 @@ import logging
 import discord
 from discord.ext import commands, tasks
 from backports.zoneinfo import ZoneInfo
+import asyncio
+import functools
 import random
 import csv
 import datetime
-from activity_tracker import ActivityTracker, PingManager
+from typing import Optional, Union
+from analytics import parse_window
+from backfill import backfill_channels
+from database import week_start
+from dispatcher import Dispatcher
+import export
+from guilds import GUILDS_FILE, GuildConfig, GuildRouter, load_guild_configs
+import metrics
 
 # Set up logging
 logging.basicConfig(
@@ -34,10 +43,19 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.reactions = True
 intents.members = True  # Need this for mention tracking
-bot = commands.Bot(command_prefix='binky!', intents=intents)
+bot = commands.AutoShardedBot(command_prefix='binky!', intents=intents)
 
-# Initialize activity tracker
-activity_tracker = None
+# One database, tracker and ping manager per guild; without guilds.json every
+# guild shares the constants above and binky_bot.db
+# Every outbound message goes through one dispatcher: per-channel queues,
+# coalescing, rate limiting and retries, so handlers never wait on a send
+dispatcher = Dispatcher()
+
+DEFAULT_GUILD = GuildConfig(None, CHANNEL_ID, tuple(RANKED_CHANNELS), 'binky_bot.db')
+guilds = GuildRouter(bot, load_guild_configs(GUILDS_FILE, DEFAULT_GUILD), dispatcher)
+
+# Event loop lag sampling and the Prometheus text file for a local scraper
+metrics_reporter = metrics.MetricsReporter()
 
 # Load quotes from ndnws.txt
 with open('ndnws.txt', 'r', encoding='utf-8') as f:
@@ -51,90 +69,271 @@ with open('emojis.csv', 'r', encoding='utf-8') as f:
 @tasks.loop(time=datetime.time(5, 0, tzinfo=ZoneInfo('America/Los_Angeles')))
 async def daily_message():
     """Task that sends a daily motivational message at 5 AM PT."""
-    channel = bot.get_channel(CHANNEL_ID)
-    if channel is None:
-        print(f"Could not find channel with ID {CHANNEL_ID}.")
-        return
-    
-    # Select a random quote and 4 random emojis
-    quote = random.choice(quotes)
-    chosen_emojis = ''.join(random.choices(emojis, k=4))
-    
-    # Send the message
-    await channel.send(f"{quote}")
-    await channel.send(f"{chosen_emojis}")
+    for context in guilds:
+        channel = bot.get_channel(context.config.channel_id)
+        if channel is None:
+            print(f"Could not find channel with ID {context.config.channel_id}.")
+            continue
+        
+        # Select a random quote and 4 random emojis
+        quote = random.choice(quotes)
+        chosen_emojis = ''.join(random.choices(emojis, k=4))
+        
+        # Send the message
+        dispatcher.send(channel, f"{quote}")
+        dispatcher.send(channel, f"{chosen_emojis}")
 
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user} (ID: {bot.user.id})')
+
+    # on_ready fires again after every gateway reconnect; set up only once
+    if guilds.started:
+        return
     
-    # Initialize activity tracker
-    global activity_tracker, ping_manager
-    activity_tracker = ActivityTracker(bot)
-    activity_tracker.set_ranked_channels(RANKED_CHANNELS)
-    activity_tracker.start_tasks()
-
-    # Initialize ping manager
-    ping_manager = PingManager(activity_tracker.db, bot, CHANNEL_ID)
-    ping_manager.start()
+    # Initialize each guild's activity tracker and ping manager
+    guilds.start()
     
     # Start the daily message loop
     daily_message.start()
+    metrics_reporter.start()
 
 @bot.event
 async def on_message(message):
     await bot.process_commands(message)
-    if activity_tracker:
-        await activity_tracker.on_message(message)
+    context = guilds.get(message)
+    if context:
+        await context.tracker.on_message(message)
 
 @bot.event
 async def on_reaction_add(reaction, user):
-    if activity_tracker:
-        await activity_tracker.on_reaction_add(reaction, user)
+    context = guilds.get(reaction.message)
+    if context:
+        await context.tracker.on_reaction_add(reaction, user)
+
+@bot.event
+async def on_reaction_remove(reaction, user):
+    context = guilds.get(reaction.message)
+    if context:
+        await context.tracker.on_reaction_remove(reaction, user)
 
 # Debug command to check last few tracked activities
 @bot.command(name='debug')
 @commands.is_owner()  # Only you can use this command
 async def debug_info(ctx):
     """Show recent tracking activity."""
-    if activity_tracker:
-        recent = activity_tracker.db.get_recent_activity()
+    context = guilds.get(ctx)
+    if context:
+        recent = await context.async_db.get_recent_activity()
         response = "📊 **Recent Activity**\n\n"
         for activity in recent:
             response += f"- {activity}\n"
-        await ctx.send(response)
+        cache = context.db.user_cache.stats()
+        response += f"\nUser cache: {cache['hits']} hits, {cache['misses']} misses, {cache['size']} cached\n"
+        dispatcher.send(ctx.channel, response)
 
 # Add a command to check current standings
 @bot.command(name='standings')
 async def show_standings(ctx):
     """Show current weekly standings."""
-    if activity_tracker:
-        scores = activity_tracker.db.get_weekly_scores()
+    context = guilds.get(ctx)
+    if context:
+        scores = context.tracker.leaderboard.top(5)
         if scores:
             response = "📊 **Current Weekly Standings**\n\n"
-            for i, (_, name, score) in enumerate(scores[:5], 1):
+            for i, (_, name, score) in enumerate(scores, 1):
                 response += f"{i}. {name}: {score:.2f} points\n"
-            await ctx.send(response)
+            dispatcher.send(ctx.channel, response)
+        else:
+            dispatcher.send(ctx.channel, "No activity recorded yet this week!")
+
+@bot.command(name='rank')
+async def show_rank(ctx, member: discord.Member = None):
+    """Show your (or another member's) position in the weekly standings."""
+    context = guilds.get(ctx)
+    if context:
+        member = member or ctx.author
+        position = context.tracker.leaderboard.rank(member.id)
+        if position:
+            rank, score, ranked = position
+            dispatcher.send(ctx.channel, f"🏅 {member.display_name} is #{rank} of {ranked} this week with {score:.2f} points")
         else:
-            await ctx.send("No activity recorded yet this week!")
+            dispatcher.send(ctx.channel, f"{member.display_name} hasn't scored any points this week yet!")
+
+@bot.command(name='history')
+async def show_history(ctx, week: Optional[str] = None):
+    """Final standings of a past week: a date in that week (YYYY-MM-DD), weeks ago (1 = last week), or the latest."""
+    context = guilds.get(ctx)
+    if not context:
+        return
+    if week is None:
+        closed = await context.async_db.get_closed_weeks(1)
+        if not closed:
+            dispatcher.send(ctx.channel, "No weeks have closed yet!")
+            return
+        day = closed[0]
+    elif week.isdigit():
+        day = datetime.datetime.utcnow().date() - datetime.timedelta(weeks=int(week))
+    else:
+        try:
+            day = datetime.date.fromisoformat(week)
+        except ValueError:
+            dispatcher.send(ctx.channel, "Give a date in the week (YYYY-MM-DD) or how many weeks ago, e.g. `binky!history 2`")
+            return
+
+    monday = week_start(day)
+    scores = await context.async_db.get_week_snapshot(monday, 10)
+    if not scores:
+        dispatcher.send(ctx.channel, f"No standings for the week of {monday} (weeks close after Sunday, UTC)")
+        return
+    response = f"📜 **Week of {monday}**\n\n"
+    for position, _, name, score in scores:
+        response += f"{position}. {name}: {score:.2f} points\n"
+    if all(user_id != ctx.author.id for _, user_id, _, _ in scores):
+        own = await context.async_db.get_week_position(monday, ctx.author.id)
+        if own:
+            position, score, ranked = own
+            response += f"\n{ctx.author.display_name}: #{position} of {ranked} with {score:.2f} points\n"
+    dispatcher.send(ctx.channel, response)
+
+@bot.command(name='leaderboard')
+async def show_leaderboard(ctx, window: str = 'week', channel: Optional[Union[discord.TextChannel, str]] = None):
+    """Standings over week, month, year, all or e.g. 14d; optionally for one channel, ranked or social."""
+    context = guilds.get(ctx)
+    if not context:
+        return
+    if context.analytics is None:
+        dispatcher.send(ctx.channel, "Leaderboards need numpy installed.")
+        return
+    try:
+        days = parse_window(window)
+    except ValueError:
+        dispatcher.send(ctx.channel, "Window must be week, month, year, all or a number of days like 14d.")
+        return
+
+    channel_id, ranked, scope = None, None, ""
+    if isinstance(channel, str):
+        if channel.lower() not in ('ranked', 'social'):
+            dispatcher.send(ctx.channel, "Pick a channel, `ranked` or `social`.")
+            return
+        ranked, scope = channel.lower() == 'ranked', f" ({channel.lower()})"
+    elif channel is not None:
+        channel_id, scope = channel.id, f" in #{channel.name}"
+
+    # The first query after a while reloads the history; keep it off the event loop
+    scores = await asyncio.get_event_loop().run_in_executor(
+        None, functools.partial(context.analytics.leaderboard, days, channel_id, ranked, 10))
+    if not scores:
+        dispatcher.send(ctx.channel, "No activity recorded in that window!")
+        return
+    response = f"📊 **Leaderboard: {window.lower()}{scope}**\n\n"
+    for i, (_, name, score) in enumerate(scores, 1):
+        response += f"{i}. {name}: {score:.2f} points\n"
+    dispatcher.send(ctx.channel, response)
+
+@bot.command(name='backfill')
+@commands.is_owner()
+async def backfill(ctx, days: Optional[int] = None):
+    """Score messages posted in ranked channels while the bot was offline.
+
+    A channel's first backfill starts after its newest stored message, or
+    covers the last `days` days if given.
+    """
+    context = guilds.get(ctx)
+    if context:
+        dispatcher.send(ctx.channel, "⏳ Backfilling channel history...")
+        channels = [c for c in (bot.get_channel(channel_id) for channel_id in context.tracker.ranked_channels)
+                    if c and c.guild == ctx.guild]
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days) if days else None
+        total = await backfill_channels(context.db, channels, context.tracker.ranked_channels, since)
+        dispatcher.send(ctx.channel, f"✅ Backfill complete: {total} messages recorded")
+
+@bot.command(name='rescore')
+@commands.is_owner()
+async def rescore(ctx):
+    """Reload this guild's scoring rules from guilds.json and recompute stored points."""
+    context = guilds.get(ctx)
+    if context:
+        try:
+            configs = load_guild_configs(GUILDS_FILE, DEFAULT_GUILD)
+        except (OSError, ValueError, KeyError) as e:
+            dispatcher.send(ctx.channel, f"❌ Could not load {GUILDS_FILE}: {e}")
+            return
+        config = next((c for c in configs if c.guild_id == context.config.guild_id), None)
+        if config is None:
+            dispatcher.send(ctx.channel, f"❌ This guild is not in {GUILDS_FILE}")
+            return
+        context.set_rules(config.scoring)
+        dispatcher.send(ctx.channel, "⏳ Rescoring activity history...")
+        rows = await asyncio.get_event_loop().run_in_executor(None, context.db.rescore)
+        dispatcher.send(ctx.channel, f"✅ Rescore complete: {rows} scores changed")
+
+@bot.command(name='snapshot')
+@commands.is_owner()
+async def snapshot(ctx):
+    """Copy a consistent backup of this guild's database without pausing tracking."""
+    context = guilds.get(ctx)
+    if context:
+        path = export.default_paths(context.db)[1]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dispatcher.send(ctx.channel, "⏳ Writing snapshot...")
+        pages = await asyncio.get_event_loop().run_in_executor(None, context.db.snapshot, path)
+        dispatcher.send(ctx.channel, f"✅ Snapshot written to `{path}` ({pages} pages)")
+
+@bot.command(name='export')
+@commands.is_owner()
+async def export_activity(ctx, fmt: str = 'csv'):
+    """Export closed weeks of activity since the last export (csv or npz)."""
+    context = guilds.get(ctx)
+    if context:
+        out = export.default_paths(context.db)[0]
+        run = functools.partial(export.export_activity, context.db, out, fmt)
+        try:
+            written = await asyncio.get_event_loop().run_in_executor(None, run)
+        except (ValueError, RuntimeError) as e:
+            dispatcher.send(ctx.channel, f"❌ {e}")
+            return
+        dispatcher.send(ctx.channel, f"✅ Exported {sum(written.values())} rows to `{out}`")
+
+@bot.command(name='perf')
+@commands.is_owner()
+async def perf(ctx):
+    """Show hot-path timings, counters and queue depths."""
+    if not metrics.ENABLED:
+        dispatcher.send(ctx.channel, "Metrics are disabled (BINKY_METRICS=0).")
+        return
+    response = "📈 **Performance**\n```\n"
+    for line in metrics.REGISTRY.summary():
+        # Stay under Discord's 2000 character limit
+        if len(response) + len(line) > 1900:
+            response += "...\n"
+            break
+        response += line + "\n"
+    dispatcher.send(ctx.channel, response + "```")
 
 @bot.command(name='ping')
 async def force_ping(ctx):
     """Force Binky to ping someone."""
-    if ping_manager:
-        candidates = ping_manager.db.get_pingable_members()
-        if candidates:
-            selected = random.choice(candidates[:5])
-            await ping_manager.ping_member(selected[0], selected[1], forced=True)
+    context = guilds.get(ctx)
+    if context:
+        try:
+            pinged = await context.ping_manager.ping_candidate(forced=True)
+        except asyncio.TimeoutError:
+            dispatcher.send(ctx.channel, "❌ The database is busy, try again in a moment.")
+            return
+        if pinged:
             await ctx.message.add_reaction('👍')
         else:
-            await ctx.send("No eligible members to ping right now!")
+            dispatcher.send(ctx.channel, "No eligible members to ping right now!")
     else:
-        await ctx.send("Ping manager not initialized!")
+        dispatcher.send(ctx.channel, "Ping manager not initialized!")
 
 @bot.command(name='noslop')
 async def noslop(ctx):
-    await ctx.send("hey")
+    dispatcher.send(ctx.channel, "hey")
 
 # Run the bot
 bot.run(BOT_TOKEN)
+
+# Flush any queued activity before the process exits
+guilds.close()
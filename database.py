@@ -1,89 +1,714 @@
 import sqlite3
-from datetime import datetime, date, timedelta
-from typing import Optional, List, Tuple
+from datetime import datetime, date, timedelta, timezone
+from typing import Optional, List, Tuple, Sequence, Iterator, Dict, Callable, Set
 import os
 import logging
+import queue
+import threading
+import functools
+import itertools
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import migrations
+from metrics import REGISTRY, DB_CALL_SECONDS, EVENTS_DUPLICATE, instrument
+from models import Event, UserEvent, MessageEvent, MentionEvent, ReactionEvent, ReactionRemoveEvent
+from scoring import DEFAULT_RULES, SCORE_EPSILON, Scorer, ScoringRules
 
 logger = logging.getLogger('binky.database')
 
+# Connection tuning applied to every connection
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+CACHED_STATEMENTS = 256
+
+# (user_id, day, points) added to the daily rollup by a batch
+Award = Tuple[int, str, float]
+
+# Columns holding an activity timestamp, and the rows converted per migration step
+TIMESTAMP_COLUMNS = (
+    ('messages', 'timestamp'),
+    ('reactions', 'timestamp'),
+    ('mentions', 'timestamp'),
+    ('member_pings', 'timestamp'),
+    ('users', 'last_message_at'),
+    ('users', 'last_pinged_at'),
+)
+MIGRATION_CHUNK_SIZE = 5000
+
+# Raw activity older than this many days is compacted into activity_daily. Each
+# compaction step moves at most COMPACTION_CHUNK_SIZE rows and each vacuum step
+# frees at most VACUUM_PAGES pages, so the write lock is only held briefly.
+RETENTION_DAYS = int(os.getenv('BINKY_RETENTION_DAYS', '90'))
+COMPACTION_CHUNK_SIZE = 5000
+VACUUM_PAGES = 1000
+
+# Messages (with their reactions and mentions) rescored per transaction
+RESCORE_CHUNK_SIZE = 20000
+
+# Pages copied per online backup step, and the pause after each step
+SNAPSHOT_PAGES = 256
+SNAPSHOT_PAUSE = 0.005
+
+# Exported tables: (column partitions are cut on, columns in file order)
+EXPORT_TABLES: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    'messages': ('timestamp', ('message_id', 'user_id', 'channel_id', 'is_ranked', 'timestamp', 'points')),
+    'reactions': ('timestamp', ('id', 'message_id', 'reactor_id', 'emoji', 'timestamp', 'points')),
+    'mentions': ('timestamp', ('id', 'message_id', 'mentioned_user_id', 'timestamp', 'points')),
+    'activity_daily': ('day', ('user_id', 'channel_id', 'day', 'messages', 'ranked_messages', 'reactions',
+                               'mentions', 'message_points', 'reaction_points', 'mention_points',
+                               'ranked_points')),
+}
+
+def to_epoch_ms(dt: datetime) -> int:
+    """Convert a naive UTC datetime to epoch milliseconds."""
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def from_epoch_ms(ms: int) -> datetime:
+    """Convert epoch milliseconds to a naive UTC datetime."""
+    return datetime(1970, 1, 1) + timedelta(milliseconds=ms)
+
+def week_start(day: date) -> date:
+    """The Monday of the (Monday to Sunday) week containing day."""
+    return day - timedelta(days=day.weekday())
+
+def parse_timestamp(value) -> datetime:
+    """Parse a stored timestamp, either epoch milliseconds or legacy datetime text."""
+    if isinstance(value, str):
+        # Legacy rows come with and without microseconds
+        return datetime.fromisoformat(value)
+    return from_epoch_ms(value)
+
+class UserCache:
+    """Bounded LRU map of user_id -> username for users known to be stored."""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_current(self, user_id: int, username: str) -> bool:
+        """Return True if the user is stored with this username."""
+        with self._lock:
+            if self._entries.get(user_id) == username:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def put(self, user_id: int, username: str) -> None:
+        """Remember that the user is stored with this username."""
+        with self._lock:
+            self._entries[user_id] = username
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters; each miss is one users upsert."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+class ReactionCounter:
+    """Time-bounded map of (message_id, reactor_id) -> number of stored reactions.
+
+    Reactions cluster on recent messages, so entries expire after ttl seconds
+    without use; a missing entry means "ask the database".
+    """
+
+    def __init__(self, ttl: float = 6 * 3600, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[int, int]) -> Optional[int]:
+        """Return the cached count, or None if unknown or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Tuple[int, int], count: int) -> None:
+        """Store the count for a key and evict expired or excess entries."""
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (count, now)
+            self._entries.move_to_end(key)
+            # Entries are ordered by last use, so expired ones are at the front
+            while self._entries:
+                _, (_, touched) = next(iter(self._entries.items()))
+                if now - touched <= self.ttl and len(self._entries) <= self.max_size:
+                    break
+                self._entries.popitem(last=False)
+
+
+class SeenToday:
+    """(user_id, day) pairs for the current UTC day whose streak is already updated.
+
+    A streak only changes on a user's first message of a day, so later messages
+    skip the users table entirely. Forgets everything when the day changes.
+    """
+
+    def __init__(self):
+        self.day: Optional[date] = None
+        self.hits = 0
+        self._seen: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Tuple[int, date]) -> bool:
+        user_id, day = key
+        with self._lock:
+            if day == self.day and user_id in self._seen:
+                self.hits += 1
+                return True
+            return False
+
+    def add(self, user_id: int, day: date) -> None:
+        today = datetime.utcnow().date()
+        if day != today:
+            return  # backfilled history; not worth remembering
+        with self._lock:
+            if self.day != today:
+                self.day = today
+                self._seen.clear()
+            self._seen.add(user_id)
+
+def _event_key(event: Event) -> Optional[Tuple]:
+    """Natural key of an event that stores a row, or None if it can't be told apart from others."""
+    if isinstance(event, MessageEvent):
+        return (0, event.message_id)
+    if isinstance(event, MentionEvent):
+        return (1, event.message_id, event.mentioned_user_id)
+    if isinstance(event, (ReactionEvent, ReactionRemoveEvent)) and event.emoji is not None:
+        return (2, event.message_id, event.reactor_id, event.emoji)
+    return None
+
+class RecentEvents:
+    """LRU of recently committed natural keys -> whether that row now exists.
+
+    Gateway resumes replay recent events, so this catches nearly every
+    duplicate before it reaches SQLite; the unique keys in the database catch
+    the rest. A reaction key maps to False once the reaction is removed, so it
+    can be added again.
+    """
+
+    def __init__(self, max_size: int = 50000):
+        self.max_size = max_size
+        self.hits = 0
+        self._entries: "OrderedDict[Tuple, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[bool]:
+        """Whether the row exists, or None if the key isn't remembered."""
+        with self._lock:
+            present = self._entries.get(key)
+            if present is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return present
+
+    def update(self, states: Dict[Tuple, bool]) -> None:
+        with self._lock:
+            for key, present in states.items():
+                self._entries[key] = present
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+@instrument(DB_CALL_SECONDS, exclude=('writer', 'reader', 'interrupt_reads', 'timestamps_migrated', 'close'))
 class Database:
-    def __init__(self, db_path: str = "binky_bot.db"):
-        """Initialize database connection and create tables if they don't exist."""
+    def __init__(self, db_path: str = "binky_bot.db", max_readers: int = 4,
+                 user_cache_size: int = 10000, guild_id: Optional[int] = None,
+                 rules: ScoringRules = DEFAULT_RULES):
+        """Open the writer connection and create tables if they don't exist."""
         self.db_path = db_path
+        # The guild this database stores, if it is one of several; labels its metrics
+        self.guild_id = guild_id
+        self.metrics_label = str(guild_id) if guild_id is not None else None
+        self.max_readers = max_readers
+        self.scorer = Scorer(rules)
+        self._write_lock = threading.RLock()
+        self._after_commit: List[Callable[[], None]] = []
+        self._listeners: List[Callable[[Sequence[Event], List[Award]], None]] = []
+        self._writer = self._connect()
+        # Read-only connections are opened lazily, up to max_readers
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._reader_lock = threading.Lock()
+        self._open_readers = 0
+        # Reader connection each thread is using right now, so its query can be interrupted
+        self._busy_readers: Dict[int, sqlite3.Connection] = {}
         self._create_tables()
+        self.user_cache = UserCache(user_cache_size)
+        self.reaction_counter = ReactionCounter()
+        self.streaks_seen = SeenToday()
+        self.recent_events = RecentEvents()
+        REGISTRY.gauge('binky_user_cache_hits', "User cache hits (skipped upserts).", lambda: self.user_cache.hits,
+                       'guild', self.metrics_label)
+        REGISTRY.gauge('binky_user_cache_misses', "User cache misses (upserts).", lambda: self.user_cache.misses,
+                       'guild', self.metrics_label)
+        REGISTRY.gauge('binky_reaction_counter_hits', "Reaction counter hits.", lambda: self.reaction_counter.hits,
+                       'guild', self.metrics_label)
+        REGISTRY.gauge('binky_reaction_counter_misses', "Reaction counter misses.", lambda: self.reaction_counter.misses,
+                       'guild', self.metrics_label)
+        self._warm_user_cache()
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection with WAL journaling and tuned pragmas."""
+        if read_only:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False,
+                                   cached_statements=CACHED_STATEMENTS)
+        else:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                                   cached_statements=CACHED_STATEMENTS)
+            # Only takes effect for new databases (or after a full VACUUM)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Yield the shared writer connection inside a transaction.
+
+        Nested calls on the same thread join the outer transaction. Callbacks
+        registered with _on_commit run after COMMIT, still holding the write lock.
+        """
+        with self._write_lock:
+            conn = self._writer
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                # COMMIT itself can fail (busy, disk full); never leave a transaction open for the next caller
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._after_commit.clear()
+                raise
+            callbacks, self._after_commit = self._after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def _on_commit(self, callback: Callable[[], None]) -> None:
+        """Run callback once the current write transaction has committed."""
+        self._after_commit.append(callback)
+
+    def add_listener(self, listener: Callable[[Sequence[Event], List[Award]], None]) -> None:
+        """Call listener(events, awards) after each committed record_batch.
+
+        awards holds (user_id, day, points) deltas for the daily rollup. Listeners
+        run on the writing thread while it still holds the write lock, so they
+        must be quick.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, events: Sequence[Event], awards: List[Award]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(events, awards)
+            except Exception:
+                logger.exception(f"Batch listener {listener!r} failed")
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Yield a pooled read-only connection.
+
+        In WAL mode readers see the last committed state and never wait on the writer.
+        """
+        if self.db_path == ':memory:':
+            # An in-memory database is private to the writer connection
+            with self._write_lock:
+                yield self._writer
+            return
+
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                can_open = self._open_readers < self.max_readers
+                if can_open:
+                    self._open_readers += 1
+            conn = self._connect(read_only=True) if can_open else self._readers.get()
+        thread_id = threading.get_ident()
+        with self._reader_lock:
+            self._busy_readers[thread_id] = conn
+        try:
+            yield conn
+        finally:
+            with self._reader_lock:
+                self._busy_readers.pop(thread_id, None)
+            self._readers.put(conn)
+
+    def interrupt_reads(self, thread_id: int) -> bool:
+        """Abort the query a thread is running on a reader connection; it raises OperationalError.
+
+        Returns False if the thread isn't reading.
+        """
+        with self._reader_lock:
+            conn = self._busy_readers.get(thread_id)
+            if conn is None:
+                return False
+            conn.interrupt()
+            return True
+
+    def close(self) -> None:
+        """Close the writer and all pooled reader connections."""
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            self._writer.close()
 
     def _create_tables(self):
-        """Create all necessary tables if they don't exist."""
-        # Read schema but split into individual statements
-        with open('schema.sql', 'r') as f:
-            schema = f.read()
-        
-        with sqlite3.connect(self.db_path) as conn:
-            # For each CREATE statement, add IF NOT EXISTS
-            for statement in schema.split(';'):
-                if statement.strip().upper().startswith('CREATE TABLE'):
-                    # Add IF NOT EXISTS clause after CREATE TABLE
-                    modified = statement.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1)
-                    if modified.strip():  # Only execute non-empty statements
-                        conn.execute(modified)
-                elif statement.strip().upper().startswith('CREATE INDEX'):
-                    # Add IF NOT EXISTS clause after CREATE INDEX
-                    modified = statement.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1)
-                    if modified.strip():  # Only execute non-empty statements
-                        conn.execute(modified)
-            conn.commit()
+        """Create or migrate the schema, then load the settings stored with the data."""
+        # The fast path is a single read; the write lock is only taken when
+        # there is something to migrate
+        if not migrations.is_current(self._writer):
+            with self.writer() as conn:
+                if migrations.migrate(conn):
+                    # New databases store epoch milliseconds from the start; older
+                    # ones keep datetime text until migrate_timestamps() has run
+                    conn.execute("""
+                        INSERT OR REPLACE INTO db_meta (key, value) VALUES ('timestamp_format', 'epoch_ms')
+                    """)
+
+        settings = dict(self._writer.execute("SELECT key, value FROM db_meta").fetchall())
+        self.epoch_timestamps = settings.get('timestamp_format') == 'epoch_ms'
+        self.compacted_before: Optional[str] = settings.get('compacted_before')
+
+    def _ts(self, dt: datetime):
+        """Convert a UTC datetime to the timestamp format this database stores."""
+        return to_epoch_ms(dt) if self.epoch_timestamps else dt
+
+    def _hour_sql(self, column: str = 'timestamp') -> str:
+        """SQL expression for the UTC hour (0-23) of a stored timestamp."""
+        if self.epoch_timestamps:
+            return f"CAST(strftime('%H', {column} / 1000, 'unixepoch') AS INTEGER)"
+        return f"CAST(strftime('%H', {column}) AS INTEGER)"
+
+    def _day_sql(self, column: str = 'timestamp') -> str:
+        """SQL expression for the UTC day of a stored timestamp."""
+        if self.epoch_timestamps:
+            return f"date({column} / 1000, 'unixepoch')"
+        return f"date({column})"
+
+    def _epoch_sql(self, column: str = 'timestamp') -> str:
+        """SQL expression for a stored timestamp as epoch milliseconds."""
+        if self.epoch_timestamps:
+            return column
+        return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)"
+
+    def timestamps_migrated(self, task: str) -> bool:
+        """Whether every timestamp is epoch ms; if not, logs that task is skipped.
+
+        Mixed text/integer timestamps don't compare reliably against a cutoff, so
+        anything that selects by timestamp range waits for migrate_timestamps().
+        """
+        if not self.epoch_timestamps:
+            logger.info(f"Skipping {task} until the timestamp migration has finished")
+        return self.epoch_timestamps
+
+    def migrate_timestamps(self, chunk_size: int = MIGRATION_CHUNK_SIZE) -> int:
+        """Convert legacy datetime text timestamps to epoch milliseconds. Returns rows converted.
+
+        Runs online: rows are converted oldest first in small transactions, so
+        ingest keeps running. Text always sorts after integers in SQLite, so the
+        unconverted rows stay at the top of each timestamp index and range
+        queries keep answering until the final step flips the format.
+        """
+        if self.epoch_timestamps:
+            return 0
+
+        def convert(conn: sqlite3.Connection, table: str, column: str, limit: int) -> int:
+            # column >= '' matches only text values and can use the timestamp index
+            return conn.execute(f"""
+                UPDATE {table}
+                SET {column} = CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)
+                WHERE rowid IN (
+                    SELECT rowid FROM {table}
+                    WHERE {column} >= ''
+                    ORDER BY {column}
+                    LIMIT ?
+                )
+            """, (limit,)).rowcount
+
+        converted = 0
+        for table, column in TIMESTAMP_COLUMNS:
+            while True:
+                with self.writer() as conn:
+                    count = convert(conn, table, column, chunk_size)
+                converted += count
+                if count < chunk_size:
+                    break
+            logger.info(f"Converted {table}.{column} to epoch milliseconds")
+
+        # Pick up rows written while migrating and flip the format atomically
+        with self.writer() as conn:
+            for table, column in TIMESTAMP_COLUMNS:
+                converted += convert(conn, table, column, -1)
+            conn.execute("""
+                INSERT OR REPLACE INTO db_meta (key, value) VALUES ('timestamp_format', 'epoch_ms')
+            """)
+            self.epoch_timestamps = True
+        logger.info(f"Timestamp migration complete: {converted} rows converted")
+        return converted
+
+    def _warm_user_cache(self) -> None:
+        """Load the most recently active users into the user cache."""
+        with self.reader() as conn:
+            rows = conn.execute("""
+                SELECT user_id, username FROM users
+                ORDER BY last_active DESC
+                LIMIT ?
+            """, (self.user_cache.max_size,)).fetchall()
+        # Insert least recent first so the most active users end up most recently used
+        for user_id, username in reversed(rows):
+            self.user_cache.put(user_id, username)
 
     def add_user(self, user_id: int, username: str) -> None:
         """Add a new user or update existing user's username."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO users (user_id, username)
-                VALUES (?, ?)
-                ON CONFLICT(user_id) DO UPDATE SET username = excluded.username
-            """, (user_id, username))
-            conn.commit()
+        self.record_batch([UserEvent(user_id, username)])
 
     def record_message(self, message_id: int, user_id: int, channel_id: int, 
                       is_ranked: bool, timestamp: datetime) -> None:
         """Record a new message."""
-        base_points = 1.5 if is_ranked else 1.0
-        
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO messages (message_id, user_id, channel_id, is_ranked, timestamp, points)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (message_id, user_id, channel_id, is_ranked, timestamp, base_points))
-            
-            # Update user's last active date and streak
-            self._update_user_streak(conn, user_id, timestamp.date())
-            conn.commit()
+        self.record_batch([MessageEvent(message_id, user_id, channel_id, is_ranked, timestamp)])
 
-    def record_reaction(self, message_id: int, reactor_id: int, timestamp: datetime) -> None:
+    def record_reaction(self, message_id: int, reactor_id: int, timestamp: datetime,
+                        emoji: Optional[str] = None) -> None:
         """Record a new reaction."""
-        with sqlite3.connect(self.db_path) as conn:
-            # Count existing reactions from this user on this message
-            existing_count = conn.execute("""
-                SELECT COUNT(*) FROM reactions 
-                WHERE message_id = ? AND reactor_id = ?
-            """, (message_id, reactor_id)).fetchone()[0]
-            
-            # Calculate points (0.5 for first reaction, 0.2 for subsequent)
-            points = 0.2 if existing_count > 0 else 0.5
-            
-            conn.execute("""
-                INSERT INTO reactions (message_id, reactor_id, timestamp, points)
-                VALUES (?, ?, ?, ?)
-            """, (message_id, reactor_id, timestamp, points))
-            conn.commit()
+        self.record_batch([ReactionEvent(message_id, reactor_id, timestamp, emoji=emoji)])
+
+    def remove_reaction(self, message_id: int, reactor_id: int, timestamp: datetime,
+                        emoji: Optional[str] = None) -> None:
+        """Remove a user's reaction with emoji (or their latest one) on a message and its points."""
+        self.record_batch([ReactionRemoveEvent(message_id, reactor_id, timestamp, emoji)])
 
     def record_mention(self, message_id: int, mentioned_user_id: int, timestamp: datetime) -> None:
         """Record a new user mention."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO mentions (message_id, mentioned_user_id, timestamp)
-                VALUES (?, ?, ?)
-            """, (message_id, mentioned_user_id, timestamp))
-            conn.commit()
+        self.record_batch([MentionEvent(message_id, mentioned_user_id, timestamp)])
+
+    def record_batch(self, events: Sequence[Event]) -> None:
+        """Record a batch of ingest events in a single transaction.
+
+        Idempotent: events already recorded (gateway replays, duplicate
+        deliveries) are skipped and counted in binky_events_duplicate.
+        """
+        # Natural keys written or removed by this batch -> whether the row exists after it
+        states: Dict[Tuple, bool] = {}
+        events = self._drop_duplicates(events, states)
+
+        # Only upsert users that are new or whose name changed
+        pending: Dict[int, str] = {}
+        for e in events:
+            if isinstance(e, UserEvent) and pending.get(e.user_id) != e.username \
+                    and not self.user_cache.is_current(e.user_id, e.username):
+                pending[e.user_id] = e.username
+        users = list(pending.items())
+        messages = [e for e in events if isinstance(e, MessageEvent)]
+        mentions = [e for e in events if isinstance(e, MentionEvent)]
+        reactions = [e for e in events if isinstance(e, (ReactionEvent, ReactionRemoveEvent))]
+        # (user_id, day) pairs whose streak this batch updated
+        streak_days: List[Tuple[int, date]] = []
+        # Reactions per (message_id, reactor_id) after this batch
+        reaction_counts: Dict[Tuple[int, int], int] = {}
+
+        # Channel of each message in the batch, for scoring its mentions and reactions
+        channels = {m.message_id: m.channel_id for m in messages}
+        # Mentions per message so far, for the mention cap
+        mention_counts: Dict[int, int] = {}
+
+        # Points per (user_id, day) to add to the daily rollup
+        rollup: Dict[Tuple[int, str], List[float]] = {}
+
+        def award(user_id: int, day: str, column: int, points: float) -> None:
+            key = (user_id, day)
+            rollup.setdefault(key, [0.0, 0.0, 0.0])[column] += points
+
+        with self.writer() as conn:
+            scorer = self.scorer
+            if users:
+                conn.executemany("""
+                    INSERT INTO users (user_id, username)
+                    VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET username = excluded.username
+                """, users)
+
+            if messages:
+                rows, inserted = [], []
+                for m in messages:
+                    points = scorer.message(m.channel_id, m.is_ranked, m.timestamp)
+                    row = (m.message_id, m.user_id, m.channel_id, m.is_ranked, self._ts(m.timestamp), points)
+                    if self._insert_new(conn, """
+                        INSERT INTO messages (message_id, user_id, channel_id, is_ranked, timestamp, points)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT DO NOTHING
+                    """, row, m, states):
+                        rows.append(row)
+                        inserted.append(m)
+                        award(m.user_id, m.timestamp.date().isoformat(), 0, points)
+
+                # Update each author's last active date and streak, once per day
+                streak_days = [key for key in dict.fromkeys((m.user_id, m.timestamp.date()) for m in inserted)
+                               if key not in self.streaks_seen]
+                for user_id, day in streak_days:
+                    self._update_user_streak(conn, user_id, day)
+                # Only move last_message_at forward; backfilled history is older
+                conn.executemany("""
+                    UPDATE users SET last_message_at = ?
+                    WHERE user_id = ? AND (last_message_at IS NULL OR last_message_at < ?)
+                """, [(ts, user_id, ts) for _, user_id, _, _, ts, _ in rows])
+
+            for m in mentions:
+                nth = mention_counts.get(m.message_id, 0)
+                points = scorer.mention(nth, self._message_channel(conn, m.message_id, channels, scorer),
+                                        m.timestamp)
+                if self._insert_new(conn, """
+                    INSERT INTO mentions (message_id, mentioned_user_id, timestamp, points)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT DO NOTHING
+                """, (m.message_id, m.mentioned_user_id, self._ts(m.timestamp), points), m, states):
+                    mention_counts[m.message_id] = nth + 1
+                    award(m.mentioned_user_id, m.timestamp.date().isoformat(), 2, points)
+
+            # Points depend on how many reactions the user already has on the
+            # message. Counts come from the reaction counter, with the
+            # (message_id, reactor_id) index as fallback on a miss.
+            for r in reactions:
+                key = (r.message_id, r.reactor_id)
+                if key not in reaction_counts:
+                    reaction_counts[key] = self._reaction_count(conn, key)
+
+                if isinstance(r, ReactionEvent):
+                    channel_id = r.channel_id or self._message_channel(conn, r.message_id, channels, scorer)
+                    points = scorer.reaction(reaction_counts[key], channel_id, r.timestamp)
+                    if self._insert_new(conn, """
+                        INSERT INTO reactions (message_id, reactor_id, timestamp, points, emoji)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT DO NOTHING
+                    """, (r.message_id, r.reactor_id, self._ts(r.timestamp), points, r.emoji), r, states):
+                        reaction_counts[key] += 1
+                        award(r.reactor_id, r.timestamp.date().isoformat(), 1, points)
+                    continue
+
+                # Removal: take back that emoji's reaction, or the user's latest
+                # reaction on the message if the emoji isn't known
+                removed = conn.execute(f"""
+                    SELECT id, points, {self._day_sql()} FROM reactions
+                    WHERE message_id = ? AND reactor_id = ? AND (? IS NULL OR emoji = ? OR emoji IS NULL)
+                    ORDER BY emoji IS NULL, id DESC LIMIT 1
+                """, (*key, r.emoji, r.emoji)).fetchone()
+                if removed:
+                    reaction_id, points, day = removed
+                    conn.execute("DELETE FROM reactions WHERE id = ?", (reaction_id,))
+                    reaction_counts[key] -= 1
+                    award(r.reactor_id, day, 1, -points)
+                if r.emoji is not None:
+                    states[_event_key(r)] = False
+
+            if rollup:
+                conn.executemany("""
+                    INSERT INTO user_daily_scores (user_id, day, message_points, reaction_points, mention_points)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, day) DO UPDATE SET
+                        message_points = message_points + excluded.message_points,
+                        reaction_points = reaction_points + excluded.reaction_points,
+                        mention_points = mention_points + excluded.mention_points
+                """, [(user_id, day, *points) for (user_id, day), points in rollup.items()])
+
+            # Caches and listeners only learn about the batch once it is committed
+            self._on_commit(functools.partial(self._batch_committed, events, users, reaction_counts, rollup,
+                                              streak_days, states))
+
+    def _batch_committed(self, events: Sequence[Event], users: List[Tuple[int, str]],
+                         reaction_counts: Dict[Tuple[int, int], int],
+                         rollup: Dict[Tuple[int, str], List[float]],
+                         streak_days: List[Tuple[int, date]], states: Dict[Tuple, bool]) -> None:
+        self.recent_events.update(states)
+        for user_id, username in users:
+            self.user_cache.put(user_id, username)
+        for user_id, day in streak_days:
+            self.streaks_seen.add(user_id, day)
+        for key, count in reaction_counts.items():
+            self.reaction_counter.set(key, count)
+        if self._listeners and rollup:
+            self._notify(events, [(user_id, day, sum(points)) for (user_id, day), points in rollup.items()])
+
+    def _drop_duplicates(self, events: Sequence[Event], states: Dict[Tuple, bool]) -> List[Event]:
+        """Events minus those the recent-event filter or an earlier event in the batch shows are replays.
+
+        Fills states with the keys decided here: a remembered add is already
+        present, a remembered removal already absent.
+        """
+        kept = []
+        for event in events:
+            key = _event_key(event)
+            if key is None:
+                kept.append(event)
+                continue
+            present = states[key] if key in states else self.recent_events.get(key)
+            removal = isinstance(event, ReactionRemoveEvent)
+            if present is None or present == removal:
+                kept.append(event)
+                # An add of an unknown key is decided by its insert; a second
+                # copy in this batch is then caught by the unique key
+                if present is not None or removal:
+                    states[key] = not removal
+            else:
+                EVENTS_DUPLICATE.labels(type(event).__name__).inc()
+        return kept
+
+    def _insert_new(self, conn: sqlite3.Connection, sql: str, row: Tuple, event: Event,
+                    states: Dict[Tuple, bool]) -> bool:
+        """Run an INSERT ... ON CONFLICT DO NOTHING; False (and counted) if the row already existed."""
+        inserted = conn.execute(sql, row).rowcount == 1
+        if not inserted:
+            EVENTS_DUPLICATE.labels(type(event).__name__).inc()
+        key = _event_key(event)
+        if key is not None:
+            states[key] = True
+        return inserted
+
+    def _message_channel(self, conn: sqlite3.Connection, message_id: int,
+                         channels: Dict[int, int], scorer: Scorer) -> Optional[int]:
+        """Channel of a message, looked up only when the scoring rules weight channels."""
+        channel_id = channels.get(message_id)
+        if channel_id is None and scorer.needs_channel:
+            row = conn.execute("SELECT channel_id FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+            channel_id = channels[message_id] = row[0] if row else 0
+        return channel_id
+
+    def _reaction_count(self, conn: sqlite3.Connection, key: Tuple[int, int]) -> int:
+        """Number of stored reactions from a user on a message."""
+        count = self.reaction_counter.get(key)
+        if count is None:
+            count = conn.execute("""
+                SELECT COUNT(*) FROM reactions
+                WHERE message_id = ? AND reactor_id = ?
+            """, key).fetchone()[0]
+        return count
 
     def _update_user_streak(self, conn: sqlite3.Connection, user_id: int, current_date: date) -> None:
         """Update user's activity streak."""
@@ -99,6 +724,7 @@ class Database:
                 conn.execute("""
                     UPDATE users 
                     SET current_streak = current_streak + 1,
+                        longest_streak = MAX(longest_streak, current_streak + 1),
                         last_active = ?
                     WHERE user_id = ?
                 """, (current_date, user_id))
@@ -106,6 +732,7 @@ class Database:
                 conn.execute("""
                     UPDATE users 
                     SET current_streak = 1,
+                        longest_streak = MAX(longest_streak, 1),
                         last_active = ?
                     WHERE user_id = ?
                 """, (current_date, user_id))
@@ -113,59 +740,199 @@ class Database:
             conn.execute("""
                 UPDATE users 
                 SET current_streak = 1,
+                    longest_streak = MAX(longest_streak, 1),
                     last_active = ?
                 WHERE user_id = ?
             """, (current_date, user_id))
 
     def get_weekly_scores(self) -> List[Tuple[int, str, float]]:
-        """Get scores for all users for the current week."""
-        with sqlite3.connect(self.db_path) as conn:
+        """Get scores for all users for the current week (today and the 6 days before)."""
+        return self.get_scores(datetime.utcnow().date() - timedelta(days=6))
+
+    def get_scores(self, start: date, end: Optional[date] = None) -> List[Tuple[int, str, float]]:
+        """Get scores for all users between two UTC days (inclusive), highest first."""
+        end = end or date.max
+        with self.reader() as conn:
             return conn.execute("""
-                WITH weekly_activity AS (
-                    SELECT u.user_id, 
-                           u.username,
-                           COALESCE(SUM(m.points), 0) as message_points,
-                           COALESCE(SUM(r.points), 0) as reaction_points,
-                           COALESCE(SUM(men.points), 0) as mention_points
-                    FROM users u
-                    LEFT JOIN messages m ON u.user_id = m.user_id 
-                        AND m.timestamp >= datetime('now', '-7 days')
-                    LEFT JOIN reactions r ON u.user_id = r.reactor_id
-                        AND r.timestamp >= datetime('now', '-7 days')
-                    LEFT JOIN mentions men ON u.user_id = men.mentioned_user_id
-                        AND men.timestamp >= datetime('now', '-7 days')
-                    GROUP BY u.user_id, u.username
-                )
-                SELECT 
-                    user_id,
-                    username,
-                    (message_points + reaction_points + mention_points) as total_score
-                FROM weekly_activity
-                WHERE total_score > 0
+                SELECT u.user_id,
+                       u.username,
+                       SUM(s.message_points + s.reaction_points + s.mention_points) as total_score
+                FROM user_daily_scores s
+                JOIN users u ON u.user_id = s.user_id
+                WHERE s.day BETWEEN ? AND ?
+                GROUP BY u.user_id, u.username
+                HAVING SUM(s.message_points + s.reaction_points + s.mention_points) > ?
                 ORDER BY total_score DESC
-            """).fetchall()
+            """, (start.isoformat(), end.isoformat(), SCORE_EPSILON)).fetchall()
 
-    def record_weekly_winner(self, user_id: int, score: float) -> None:
-        """Record a weekly winner."""
-        week_start = date.today() - timedelta(days=7)
-        week_end = date.today()
-        
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO weekly_winners (user_id, week_start, week_end, total_score)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, week_start, week_end, score))
-            conn.commit()
+    def get_daily_scores(self, start: date) -> List[Tuple[int, str, str, float]]:
+        """Get (user_id, username, day, points) rollup rows from start onwards.
+
+        Reads on the writer connection so the result lines up exactly with the
+        batches already passed to listeners.
+        """
+        with self.writer() as conn:
+            return conn.execute("""
+                SELECT u.user_id, u.username, s.day,
+                       s.message_points + s.reaction_points + s.mention_points
+                FROM user_daily_scores s
+                JOIN users u ON u.user_id = s.user_id
+                WHERE s.day >= ?
+            """, (start.isoformat(),)).fetchall()
+
+    def rebuild_daily_scores(self) -> int:
+        """Rebuild the daily score rollup from the raw and compacted activity. Returns rows written."""
+        with self.writer() as conn:
+            conn.execute("DELETE FROM user_daily_scores")
+            day = self._day_sql()
+            conn.execute(f"""
+                INSERT INTO user_daily_scores (user_id, day, message_points, reaction_points, mention_points)
+                SELECT user_id, day, SUM(message_points), SUM(reaction_points), SUM(mention_points)
+                FROM (
+                    SELECT user_id, {day} as day,
+                           points as message_points, 0 as reaction_points, 0 as mention_points
+                    FROM messages
+                    UNION ALL
+                    SELECT reactor_id, {day}, 0, points, 0
+                    FROM reactions
+                    UNION ALL
+                    SELECT mentioned_user_id, {day}, 0, 0, points
+                    FROM mentions
+                    UNION ALL
+                    SELECT user_id, day, message_points, reaction_points, mention_points
+                    FROM activity_daily
+                )
+                GROUP BY user_id, day
+            """)
+            return conn.execute("SELECT COUNT(*) FROM user_daily_scores").fetchone()[0]
+
+    def recompute_streaks(self) -> int:
+        """Rebuild current_streak, longest_streak and last_active for all users from message history.
+
+        One ordered pass over the days each user posted, raw and compacted, for
+        repairs after outages and backfills. Returns the number of users with
+        any messages.
+        """
+        streaks = []
+        with self.writer() as conn:
+            rows = conn.execute(f"""
+                SELECT user_id, {self._day_sql()} FROM messages
+                UNION
+                SELECT user_id, day FROM activity_daily WHERE messages > 0
+                ORDER BY 1, 2
+            """)
+            for user_id, days in itertools.groupby(rows, key=lambda row: row[0]):
+                current = longest = 0
+                previous = None
+                for _, day_text in days:
+                    day = date.fromisoformat(day_text)
+                    current = current + 1 if previous and (day - previous).days == 1 else 1
+                    longest = max(longest, current)
+                    previous = day
+                streaks.append((current, longest, previous.isoformat(), user_id))
+
+            conn.execute("UPDATE users SET current_streak = 0, longest_streak = 0, last_active = NULL")
+            conn.executemany("""
+                UPDATE users SET current_streak = ?, longest_streak = ?, last_active = ?
+                WHERE user_id = ?
+            """, streaks)
+        logger.info(f"Recomputed streaks for {len(streaks)} users")
+        return len(streaks)
+
+    def set_rules(self, rules: ScoringRules) -> None:
+        """Score new activity with rules from the next batch on. Stored points are unchanged until rescore()."""
+        with self._write_lock:
+            self.scorer = Scorer(rules)
+        logger.info(f"Scoring rules updated: {rules}")
+
+    def rescore(self, chunk_size: int = RESCORE_CHUNK_SIZE) -> int:
+        """Recompute stored points with the current scoring rules. Returns rows changed.
+
+        Works through messages in ranges of chunk_size message IDs, taking their
+        reactions and mentions along so each message's reaction and mention order
+        is complete within one transaction. Only rows whose points change are
+        written; the differences go into the daily rollup and to the listeners in
+        the same transaction, so standings stay consistent while it runs.
+        Compacted activity keeps the points it was compacted with.
+        """
+        scorer = self.scorer
+        day = self._day_sql('ts')
+        hour = scorer.hour_sql(self._epoch_sql('ts'), self._hour_sql('ts'))
+        # (table, key column, rollup column, inner query, points expression)
+        kinds = [
+            ('messages', 'message_id', 'message_points', """
+                SELECT message_id AS row_id, user_id, timestamp AS ts, points, channel_id, is_ranked
+                FROM messages WHERE message_id > ? AND message_id <= ?
+            """, scorer.message_sql('is_ranked', 'channel_id', hour)),
+            ('reactions', 'id', 'reaction_points', """
+                SELECT x.id AS row_id, x.reactor_id AS user_id, x.timestamp AS ts, x.points, m.channel_id,
+                       ROW_NUMBER() OVER (PARTITION BY x.message_id, x.reactor_id ORDER BY x.id) - 1 AS nth
+                FROM reactions x LEFT JOIN messages m ON m.message_id = x.message_id
+                WHERE x.message_id > ? AND x.message_id <= ?
+            """, scorer.reaction_sql('nth', 'channel_id', hour)),
+            ('mentions', 'id', 'mention_points', """
+                SELECT x.id AS row_id, x.mentioned_user_id AS user_id, x.timestamp AS ts, x.points, m.channel_id,
+                       ROW_NUMBER() OVER (PARTITION BY x.message_id ORDER BY x.id) - 1 AS nth
+                FROM mentions x LEFT JOIN messages m ON m.message_id = x.message_id
+                WHERE x.message_id > ? AND x.message_id <= ?
+            """, scorer.mention_sql('nth', 'channel_id', hour)),
+        ]
+
+        changed, low = 0, -1
+        while True:
+            with self.writer() as conn:
+                scorer.register(conn)
+                conn.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS rescored (
+                        row_id INTEGER PRIMARY KEY, user_id INTEGER, day TEXT, delta REAL, points REAL
+                    )
+                """)
+                row = conn.execute("""
+                    SELECT message_id FROM messages WHERE message_id > ? ORDER BY message_id LIMIT 1 OFFSET ?
+                """, (low, chunk_size - 1)).fetchone()
+                # The last range is open-ended so reactions and mentions on
+                # messages that were never stored are rescored too
+                high = row[0] if row else 2 ** 63 - 1
+                awards: Dict[Tuple[int, str], float] = {}
+                for table, key, column, rows, points in kinds:
+                    conn.execute(f"""
+                        INSERT INTO temp.rescored (row_id, user_id, day, delta, points)
+                        SELECT row_id, user_id, {day}, new_points - points, new_points
+                        FROM (SELECT *, {points} AS new_points FROM ({rows}))
+                        WHERE new_points IS NOT points
+                    """, (low, high))
+                    conn.execute(f"""
+                        UPDATE {table} SET points = (SELECT points FROM temp.rescored WHERE row_id = {table}.{key})
+                        WHERE {key} IN (SELECT row_id FROM temp.rescored)
+                    """)
+                    deltas = conn.execute("""
+                        SELECT user_id, day, SUM(delta) FROM temp.rescored GROUP BY user_id, day
+                    """).fetchall()
+                    conn.executemany(f"""
+                        INSERT INTO user_daily_scores (user_id, day, {column}) VALUES (?, ?, ?)
+                        ON CONFLICT(user_id, day) DO UPDATE SET {column} = {column} + excluded.{column}
+                    """, deltas)
+                    for user_id, day_text, delta in deltas:
+                        awards[(user_id, day_text)] = awards.get((user_id, day_text), 0.0) + delta
+                    changed += conn.execute("DELETE FROM temp.rescored").rowcount
+                if awards:
+                    self._on_commit(functools.partial(
+                        self._notify, [], [(user_id, day_text, delta) for (user_id, day_text), delta in awards.items()]))
+            if row is None:
+                break
+            low = high
+            time.sleep(0)  # let queued writers take the lock between chunks
+        logger.info(f"Rescored {changed} rows")
+        return changed
 
     def reset_weekly_scores(self) -> None:
         """Reset weekly scores while maintaining streaks."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.writer() as conn:
             conn.execute("UPDATE users SET weekly_score = 0")
-            conn.commit()
             
     def get_recent_activity(self, limit: int = 10) -> List[str]:
         """Get recent activity for debugging purposes."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.reader() as conn:
             # Get recent messages
             messages = conn.execute("""
                 SELECT u.username, m.timestamp, m.is_ranked, m.points
@@ -191,63 +958,520 @@ class Database:
             
             for username, timestamp, points in reactions:
                 activities.append(f"Reaction by {username} - {points} points")
+
+            # Older activity only survives as daily totals once compacted
+            if len(activities) < limit:
+                compacted = conn.execute("""
+                    SELECT u.username, a.day, SUM(a.messages), SUM(a.reactions),
+                           SUM(a.message_points + a.reaction_points + a.mention_points)
+                    FROM activity_daily a
+                    JOIN users u ON a.user_id = u.user_id
+                    GROUP BY a.day, a.user_id
+                    ORDER BY a.day DESC
+                    LIMIT ?
+                """, (limit - len(activities),)).fetchall()
+                for username, day, message_count, reaction_count, points in compacted:
+                    activities.append(f"{day}: {message_count} messages, {reaction_count} reactions "
+                                      f"by {username} (compacted) - {points:.1f} points")
             
             return activities[:limit]
 
+####################################### weekly snapshots
+
+    def close_weeks(self, today: Optional[date] = None) -> List[date]:
+        """Snapshot the final standings of every finished, unclosed week. Returns their Mondays.
+
+        Weeks run Monday to Sunday (UTC) and close once their Sunday is over.
+        Weeks missed while the bot was down are closed too, oldest first, each
+        in its own transaction. A week is closed at most once, and its snapshot
+        is never changed afterwards, even if backfill or rescore later changes
+        the points behind it.
+        """
+        this_week = week_start(today or datetime.utcnow().date())
+        with self.reader() as conn:
+            last_closed, first_day = conn.execute("""
+                SELECT (SELECT MAX(week_start) FROM weekly_closes), (SELECT MIN(day) FROM user_daily_scores)
+            """).fetchone()
+        if last_closed:
+            week = date.fromisoformat(last_closed) + timedelta(days=7)
+        elif first_day:
+            week = week_start(date.fromisoformat(first_day))
+        else:
+            return []
+
+        closed = []
+        while week < this_week:
+            with self.writer() as conn:
+                if not conn.execute("SELECT 1 FROM weekly_closes WHERE week_start = ?", (week.isoformat(),)).fetchone():
+                    self._close_week(conn, week)
+                    closed.append(week)
+            week += timedelta(days=7)
+        return closed
+
+    def _close_week(self, conn: sqlite3.Connection, week: date) -> None:
+        """Freeze one week's standings. Caller holds a write transaction."""
+        start, end = week.isoformat(), (week + timedelta(days=6)).isoformat()
+        conn.execute("""
+            INSERT INTO weekly_snapshots (week_start, position, user_id, username, score)
+            SELECT ?, ROW_NUMBER() OVER (ORDER BY s.score DESC, s.user_id), s.user_id, u.username, s.score
+            FROM (
+                SELECT user_id, SUM(message_points + reaction_points + mention_points) AS score
+                FROM user_daily_scores
+                WHERE day BETWEEN ? AND ?
+                GROUP BY user_id
+                HAVING score > ?
+            ) s
+            JOIN users u ON u.user_id = s.user_id
+        """, (start, start, end, SCORE_EPSILON))
+        users, total, winner_id, winner_score = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(score), 0),
+                   MAX(CASE WHEN position = 1 THEN user_id END), MAX(CASE WHEN position = 1 THEN score END)
+            FROM weekly_snapshots WHERE week_start = ?
+        """, (start,)).fetchone()
+        # Weeks whose winner was recorded (and announced) before snapshots existed
+        # keep their weekly_winners row and aren't announced again
+        legacy = conn.execute("""
+            SELECT 1 FROM weekly_winners WHERE week_end BETWEEN ? AND ?
+        """, (start, end)).fetchone() is not None
+        now = to_epoch_ms(datetime.utcnow())
+        conn.execute("""
+            INSERT INTO weekly_closes (week_start, users, total_points, closed_at, announced_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (start, users, total, now, now if legacy else None))
+        if winner_id is not None and not legacy:
+            conn.execute("""
+                INSERT INTO weekly_winners (user_id, week_start, week_end, total_score)
+                VALUES (?, ?, ?, ?)
+            """, (winner_id, start, end, winner_score))
+        logger.info(f"Closed week of {start}: {users} users, {total:.2f} points")
+
+    def get_week_snapshot(self, week: date, limit: Optional[int] = None) -> List[Tuple[int, int, str, float]]:
+        """(position, user_id, username, score) for a closed week, best first; empty if not closed."""
+        with self.reader() as conn:
+            return conn.execute("""
+                SELECT position, user_id, username, score FROM weekly_snapshots
+                WHERE week_start = ?
+                ORDER BY position
+                LIMIT ?
+            """, (week_start(week).isoformat(), -1 if limit is None else limit)).fetchall()
+
+    def get_week_position(self, week: date, user_id: int) -> Optional[Tuple[int, float, int]]:
+        """(position, score, ranked users) for a user in a closed week, or None if they didn't score."""
+        with self.reader() as conn:
+            return conn.execute("""
+                SELECT s.position, s.score, c.users
+                FROM weekly_snapshots s
+                JOIN weekly_closes c ON c.week_start = s.week_start
+                WHERE s.week_start = ? AND s.user_id = ?
+            """, (week_start(week).isoformat(), user_id)).fetchone()
+
+    def get_closed_weeks(self, limit: int = 10) -> List[date]:
+        """Mondays of the most recently closed weeks, newest first."""
+        with self.reader() as conn:
+            rows = conn.execute("""
+                SELECT week_start FROM weekly_closes ORDER BY week_start DESC LIMIT ?
+            """, (limit,)).fetchall()
+        return [date.fromisoformat(row[0]) for row in rows]
+
+    def get_unannounced_weeks(self) -> List[date]:
+        """Mondays of closed weeks whose winner hasn't been announced, oldest first."""
+        with self.reader() as conn:
+            rows = conn.execute("""
+                SELECT week_start FROM weekly_closes WHERE announced_at IS NULL ORDER BY week_start
+            """).fetchall()
+        return [date.fromisoformat(row[0]) for row in rows]
+
+    def mark_weeks_announced(self, weeks: Sequence[date]) -> None:
+        with self.writer() as conn:
+            conn.executemany("""
+                UPDATE weekly_closes SET announced_at = ? WHERE week_start = ? AND announced_at IS NULL
+            """, [(to_epoch_ms(datetime.utcnow()), week.isoformat()) for week in weeks])
+
+####################################### retention
+
+    def compact_activity(self, retention_days: int = RETENTION_DAYS,
+                         chunk_size: int = COMPACTION_CHUNK_SIZE) -> int:
+        """Roll raw activity older than retention_days into activity_daily. Returns rows compacted.
+
+        Whole UTC days are compacted, oldest first, in transactions of at most
+        chunk_size rows so ingest is never blocked for long. Reactions and
+        mentions go before messages so they can still find their channel.
+        """
+        if retention_days < 7:
+            raise ValueError("retention_days must cover the 7-day scoring window")
+        if not self.timestamps_migrated('compaction'):
+            return 0
+
+        cutoff_day = datetime.utcnow().date() - timedelta(days=retention_days)
+        cutoff = self._ts(datetime.combine(cutoff_day, datetime.min.time()))
+        day = self._day_sql('x.timestamp')
+        aggregates = {
+            'reactions': f"""
+                INSERT INTO activity_daily (user_id, channel_id, day, reactions, reaction_points, ranked_points)
+                SELECT x.reactor_id, COALESCE(m.channel_id, 0), {day}, COUNT(*), SUM(x.points),
+                       SUM(CASE WHEN m.is_ranked THEN x.points ELSE 0 END)
+                FROM reactions x
+                LEFT JOIN messages m ON m.message_id = x.message_id
+                WHERE x.rowid IN (SELECT id FROM temp.compact_ids)
+                GROUP BY 1, 2, 3
+                ON CONFLICT(user_id, channel_id, day) DO UPDATE SET
+                    reactions = reactions + excluded.reactions,
+                    reaction_points = reaction_points + excluded.reaction_points,
+                    ranked_points = ranked_points + excluded.ranked_points
+            """,
+            'mentions': f"""
+                INSERT INTO activity_daily (user_id, channel_id, day, mentions, mention_points, ranked_points)
+                SELECT x.mentioned_user_id, COALESCE(m.channel_id, 0), {day}, COUNT(*), SUM(x.points),
+                       SUM(CASE WHEN m.is_ranked THEN x.points ELSE 0 END)
+                FROM mentions x
+                LEFT JOIN messages m ON m.message_id = x.message_id
+                WHERE x.rowid IN (SELECT id FROM temp.compact_ids)
+                GROUP BY 1, 2, 3
+                ON CONFLICT(user_id, channel_id, day) DO UPDATE SET
+                    mentions = mentions + excluded.mentions,
+                    mention_points = mention_points + excluded.mention_points,
+                    ranked_points = ranked_points + excluded.ranked_points
+            """,
+            'messages': f"""
+                INSERT INTO activity_daily (user_id, channel_id, day, messages, ranked_messages, message_points,
+                                            ranked_points)
+                SELECT x.user_id, x.channel_id, {day}, COUNT(*), SUM(x.is_ranked), SUM(x.points),
+                       SUM(CASE WHEN x.is_ranked THEN x.points ELSE 0 END)
+                FROM messages x
+                WHERE x.rowid IN (SELECT id FROM temp.compact_ids)
+                GROUP BY 1, 2, 3
+                ON CONFLICT(user_id, channel_id, day) DO UPDATE SET
+                    messages = messages + excluded.messages,
+                    ranked_messages = ranked_messages + excluded.ranked_messages,
+                    message_points = message_points + excluded.message_points,
+                    ranked_points = ranked_points + excluded.ranked_points
+            """,
+        }
+
+        compacted = 0
+        for table, aggregate in aggregates.items():
+            while True:
+                with self.writer() as conn:
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS compact_ids (id INTEGER PRIMARY KEY)")
+                    count = conn.execute(f"""
+                        INSERT INTO temp.compact_ids
+                        SELECT rowid FROM {table} WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+                    """, (cutoff, chunk_size)).rowcount
+                    if count:
+                        conn.execute(aggregate)
+                        conn.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT id FROM temp.compact_ids)")
+                    conn.execute("DELETE FROM temp.compact_ids")
+                    if count:
+                        # Backfill must not re-add what is now only counted here
+                        conn.execute("""
+                            INSERT INTO db_meta (key, value) VALUES ('compacted_before', ?)
+                            ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+                        """, (cutoff_day.isoformat(),))
+                        self.compacted_before = max(self.compacted_before or '', cutoff_day.isoformat())
+                compacted += count
+                if count < chunk_size:
+                    break
+                time.sleep(0)  # let queued writers take the lock between chunks
+            logger.info(f"Compacted {table} older than {cutoff_day}")
+
+        pages = self.vacuum_free_pages()
+        logger.info(f"Compaction complete: {compacted} rows compacted, {pages} pages freed")
+        return compacted
+
+    def vacuum_free_pages(self, pages: int = VACUUM_PAGES) -> int:
+        """Return free pages to the filesystem a few at a time. Returns pages freed.
+
+        Needs auto_vacuum=INCREMENTAL, which new databases get; older ones need a
+        one-off vacuum() first.
+        """
+        if self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.info("Incremental vacuum is off for this database; run maintenance.py vacuum once")
+            return 0
+        freed = 0
+        while True:
+            with self._write_lock:
+                conn = self._writer
+                before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                # execute() only steps the pragma once (one page); executescript
+                # runs it to completion in its own transaction
+                conn.executescript(f"PRAGMA incremental_vacuum({pages});")
+                step = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            freed += step
+            if step < pages:
+                return freed
+            time.sleep(0)
+
+    def vacuum(self) -> None:
+        """Rebuild the whole database file, switching it to incremental auto-vacuum.
+
+        Blocks all writes while it runs; meant for maintenance windows.
+        """
+        with self._write_lock:
+            self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._writer.execute("VACUUM")
+
+####################################### analytics
+
+    def iter_activity(self, chunk_size: int = 50000) -> Iterator[List[Tuple[int, int, int, float, int]]]:
+        """Yield every scored action, raw and compacted, in chunks.
+
+        Rows are (user_id, channel_id, epoch_ms, points, is_ranked). Reactions and
+        mentions take the channel of their message (0 if it wasn't stored);
+        compacted rows are stamped at the start of their day, split into their
+        ranked and social points.
+        """
+        with self.reader() as conn:
+            cursor = conn.execute(f"""
+                SELECT user_id, channel_id, {self._epoch_sql()}, points, is_ranked
+                FROM messages
+                UNION ALL
+                SELECT x.reactor_id, COALESCE(m.channel_id, 0), {self._epoch_sql('x.timestamp')}, x.points,
+                       COALESCE(m.is_ranked, 0)
+                FROM reactions x
+                LEFT JOIN messages m ON m.message_id = x.message_id
+                UNION ALL
+                SELECT x.mentioned_user_id, COALESCE(m.channel_id, 0), {self._epoch_sql('x.timestamp')}, x.points,
+                       COALESCE(m.is_ranked, 0)
+                FROM mentions x
+                LEFT JOIN messages m ON m.message_id = x.message_id
+                UNION ALL
+                SELECT user_id, channel_id, CAST(strftime('%s', day) AS INTEGER) * 1000, ranked_points, 1
+                FROM activity_daily WHERE ranked_points != 0
+                UNION ALL
+                SELECT user_id, channel_id, CAST(strftime('%s', day) AS INTEGER) * 1000,
+                       message_points + reaction_points + mention_points - ranked_points, 0
+                FROM activity_daily WHERE message_points + reaction_points + mention_points != ranked_points
+            """)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+
+    def get_usernames(self) -> Dict[int, str]:
+        """Map every known user ID to its username."""
+        with self.reader() as conn:
+            return dict(conn.execute("SELECT user_id, username FROM users").fetchall())
+
+####################################### export
+
+    def snapshot(self, dest_path: str, pages: int = SNAPSHOT_PAGES, pause: float = SNAPSHOT_PAUSE) -> int:
+        """Copy a consistent snapshot of the database to dest_path while ingest carries on. Returns pages copied.
+
+        Uses SQLite's online backup API, pages at a time, from a read-only
+        connection that holds one read transaction throughout. The copy is of a
+        single point in time and never restarts because of concurrent writes
+        (without the open transaction every commit would restart it). The pause
+        after each step leaves I/O for ingest. The WAL can't be checkpointed
+        past the snapshot until it finishes.
+        """
+        tmp = f"{dest_path}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        copied = [0]
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            copied[0] = total - remaining
+            time.sleep(pause)
+
+        dest = sqlite3.connect(tmp)
+        try:
+            if self.db_path == ':memory:':
+                with self._write_lock:
+                    self._writer.backup(dest, pages=pages, progress=progress)
+            else:
+                source = self._connect(read_only=True)
+                try:
+                    source.execute("BEGIN")
+                    source.execute("SELECT 1 FROM sqlite_master LIMIT 1")  # starts the read transaction
+                    source.backup(dest, pages=pages, progress=progress)
+                    source.execute("COMMIT")
+                finally:
+                    source.close()
+        finally:
+            dest.close()
+        os.replace(tmp, dest_path)
+        logger.info(f"Snapshot of {self.db_path} written to {dest_path} ({copied[0]} pages)")
+        return copied[0]
+
+    def export_weeks(self, table: str) -> List[date]:
+        """Mondays of the weeks that have rows in an exported table, oldest first."""
+        time_column = EXPORT_TABLES[table][0]
+        with self.reader() as conn:
+            first, last = conn.execute(f"SELECT MIN({time_column}), MAX({time_column}) FROM {table}").fetchone()
+        if first is None:
+            return []
+        if table == 'activity_daily':
+            first, last = date.fromisoformat(first), date.fromisoformat(last)
+        else:
+            first, last = parse_timestamp(first).date(), parse_timestamp(last).date()
+        weeks, week = [], week_start(first)
+        while week <= last:
+            weeks.append(week)
+            week += timedelta(days=7)
+        return weeks
+
+    def iter_export(self, table: str, week: date, chunk_size: int = 50000,
+                    since: Optional[date] = None) -> Iterator[List[Tuple]]:
+        """Yield one week of an exported table in time order, chunk_size rows at a time.
+
+        With since, only the week's rows from that day on. Columns are those in
+        EXPORT_TABLES; timestamps are epoch milliseconds.
+        """
+        time_column, columns = EXPORT_TABLES[table]
+        start, end = week_start(week), week_start(week) + timedelta(days=7)
+        if since is not None:
+            start = max(start, since)
+        if table == 'activity_daily':
+            bounds = (start.isoformat(), end.isoformat())
+        else:
+            bounds = (self._ts(datetime.combine(start, datetime.min.time())),
+                      self._ts(datetime.combine(end, datetime.min.time())))
+        select = ', '.join(self._epoch_sql(c) if c == 'timestamp' else c for c in columns)
+        with self.reader() as conn:
+            cursor = conn.execute(f"""
+                SELECT {select} FROM {table}
+                WHERE {time_column} >= ? AND {time_column} < ?
+                ORDER BY {time_column}, rowid
+            """, bounds)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+
 ####################################### ping member feature
 
     def get_last_activity_time(self) -> Optional[datetime]:
         """Get the timestamp of the last message in any channel."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.reader() as conn:
             result = conn.execute("""
-                SELECT MAX(timestamp)
-                FROM messages
+                SELECT MAX(last_message_at)
+                FROM users
             """).fetchone()
             
             if result and result[0]:
-                return datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S.%f')
+                return parse_timestamp(result[0])
             return None
 
     def get_last_ping_time(self) -> Optional[datetime]:
         """Get the timestamp of the last ping sent."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.reader() as conn:
             result = conn.execute("""
                 SELECT MAX(timestamp)
                 FROM member_pings
             """).fetchone()
             
             if result and result[0]:
-                return datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S.%f')
+                return parse_timestamp(result[0])
             return None
 
-    def get_pingable_members(self) -> List[Tuple[int, str, datetime]]:
-        """Get members who haven't been pinged in 7 days, ordered by last activity."""
-        with sqlite3.connect(self.db_path) as conn:
-            return conn.execute("""
-                WITH LastPings AS (
-                    SELECT user_id, MAX(timestamp) as last_ping
-                    FROM member_pings
-                    GROUP BY user_id
-                ),
-                LastActivity AS (
-                    SELECT user_id, MAX(timestamp) as last_active
-                    FROM messages
-                    GROUP BY user_id
-                )
-                SELECT u.user_id, u.username, COALESCE(la.last_active, '2000-01-01') as last_active
-                FROM users u
-                LEFT JOIN LastPings lp ON u.user_id = lp.user_id
-                LEFT JOIN LastActivity la ON u.user_id = la.user_id
-                WHERE (lp.last_ping IS NULL OR 
-                      lp.last_ping <= datetime('now', '-7 days'))
-                ORDER BY last_active ASC
-            """).fetchall()
+    def get_pingable_members(self, limit: Optional[int] = None) -> List[Tuple[int, str, datetime]]:
+        """Get up to limit members who haven't been pinged in 7 days, least recently active first."""
+        cutoff = self._ts(datetime.utcnow() - timedelta(days=7))
+        never = self._ts(datetime(2000, 1, 1))
+        with self.reader() as conn:
+            # Walks idx_users_last_activity in order (never-active users first) and
+            # stops after limit rows; the ping filter is answered from the index
+            rows = conn.execute("""
+                SELECT user_id, username, COALESCE(last_message_at, ?) as last_active
+                FROM users
+                WHERE last_pinged_at IS NULL OR last_pinged_at <= ?
+                ORDER BY last_message_at ASC
+                LIMIT ?
+            """, (never, cutoff, -1 if limit is None else limit)).fetchall()
+        return [(user_id, username, parse_timestamp(last_active)) for user_id, username, last_active in rows]
 
     def record_ping(self, user_id: int, question: str, forced: bool = False) -> None:
         """Record a ping sent to a user."""
-        with sqlite3.connect(self.db_path) as conn:
+        timestamp = self._ts(datetime.utcnow())
+        with self.writer() as conn:
             conn.execute("""
                 INSERT INTO member_pings (user_id, timestamp, question, forced)
-                VALUES (?, datetime('now'), ?, ?)
-            """, (user_id, question, forced))
-            conn.commit()
+                VALUES (?, ?, ?, ?)
+            """, (user_id, timestamp, question, forced))
+            conn.execute("""
+                UPDATE users SET last_pinged_at = ? WHERE user_id = ?
+            """, (timestamp, user_id))
+
+    def repair_activity_columns(self) -> int:
+        """Recompute users.last_message_at / last_pinged_at from the raw tables.
+
+        Users whose messages have all been compacted keep their stored
+        last_message_at. Returns the number of users that were fixed.
+        """
+        with self.writer() as conn:
+            rows = conn.execute("""
+                SELECT user_id, expected_message, expected_ping FROM (
+                    SELECT u.user_id, u.last_message_at, u.last_pinged_at,
+                           COALESCE(
+                               (SELECT MAX(timestamp) FROM messages m WHERE m.user_id = u.user_id),
+                               CASE WHEN EXISTS (SELECT 1 FROM activity_daily a
+                                                 WHERE a.user_id = u.user_id AND a.messages > 0)
+                                    THEN u.last_message_at END
+                           ) AS expected_message,
+                           (SELECT MAX(timestamp) FROM member_pings p WHERE p.user_id = u.user_id) AS expected_ping
+                    FROM users u
+                )
+                WHERE last_message_at IS NOT expected_message OR last_pinged_at IS NOT expected_ping
+            """).fetchall()
+            conn.executemany("""
+                UPDATE users SET last_message_at = ?, last_pinged_at = ? WHERE user_id = ?
+            """, [(last_message, last_ping, user_id) for user_id, last_message, last_ping in rows])
+        if rows:
+            logger.info(f"Repaired last activity columns for {len(rows)} users")
+        return len(rows)
+
+####################################### history backfill
+
+    def get_backfill_checkpoint(self, channel_id: int) -> Optional[int]:
+        """Get the ID of the newest message backfilled from a channel."""
+        with self.reader() as conn:
+            result = conn.execute("""
+                SELECT last_message_id FROM backfill_checkpoints WHERE channel_id = ?
+            """, (channel_id,)).fetchone()
+            return result[0] if result else None
+
+    def get_newest_message_id(self, channel_id: int) -> Optional[int]:
+        """Get the ID of the newest stored message from a channel, however it was recorded."""
+        with self.reader() as conn:
+            return conn.execute("SELECT MAX(message_id) FROM messages WHERE channel_id = ?",
+                                (channel_id,)).fetchone()[0]
+
+    def record_backfill_batch(self, channel_id: int,
+                              messages: Sequence[Tuple[int, Sequence[Event]]]) -> int:
+        """Record backfilled (message_id, events) pairs and advance the channel checkpoint.
+
+        Messages that are already stored, or from days that have been compacted,
+        are skipped along with their mentions and reactions. Returns the number of
+        messages written.
+        """
+        if not messages:
+            return 0
+        message_ids = [message_id for message_id, _ in messages]
+        with self.writer() as conn:
+            stored = set()
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                stored.update(row[0] for row in conn.execute(f"""
+                    SELECT message_id FROM messages
+                    WHERE message_id IN ({','.join('?' * len(chunk))})
+                """, chunk))
+
+            if self.compacted_before:
+                # Compacted messages are no longer in the table but are already counted
+                stored.update(e.message_id for _, events in messages for e in events
+                              if isinstance(e, MessageEvent)
+                              and e.timestamp.date().isoformat() < self.compacted_before)
+
+            new = [(message_id, events) for message_id, events in messages if message_id not in stored]
+            self.record_batch([event for _, events in new for event in events])
+            conn.execute("""
+                INSERT INTO backfill_checkpoints (channel_id, last_message_id, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    last_message_id = MAX(last_message_id, excluded.last_message_id),
+                    updated_at = excluded.updated_at
+            """, (channel_id, max(message_ids), to_epoch_ms(datetime.utcnow())))
+        # Bot messages are passed with no events; they only advance the checkpoint
+        return sum(1 for _, events in new if events)
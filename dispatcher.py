@@ -0,0 +1,200 @@
+"""Outbound message dispatcher.
+
+Callers queue text with send() and carry on; one task per channel with queued
+messages delivers them in order. Messages queued behind each other for the
+same channel are joined into one (up to Discord's 2000 character limit), a
+token bucket per channel and a shared one keep sends under Discord's rate
+limits, and sends that hit a rate limit or a server error are retried with
+jittered exponential backoff.
+
+Channels are duck-typed: anything with an id and an async send(content) will
+do, so benchmarks.stubs.StubChannel can stand in for a discord channel.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+logger = logging.getLogger('binky.dispatcher')
+
+MAX_MESSAGE_LENGTH = 2000
+# (messages, seconds): Discord allows 5 messages per 5s per channel and 50 requests/s per bot
+CHANNEL_RATE = (5, 5.0)
+GLOBAL_RATE = (50, 1.0)
+
+MESSAGES_SENT = REGISTRY.counter('binky_dispatch_sent', "Messages delivered by the dispatcher.")
+MESSAGES_COALESCED = REGISTRY.counter('binky_dispatch_coalesced', "Queued messages joined onto an earlier one.")
+SEND_RETRIES = REGISTRY.counter('binky_dispatch_retries', "Sends retried after a rate limit or error.", 'reason')
+SEND_FAILURES = REGISTRY.counter('binky_dispatch_failures', "Queued messages given up on.")
+
+# A queued message and the future its sender got back
+Pending = Tuple[str, "asyncio.Future"]
+
+
+class TokenBucket:
+    """Allows capacity sends at once, refilled at capacity per period seconds."""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available; 0 if one is available now."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hold off all sends for seconds, e.g. after the server reported a rate limit."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+def _retry_reason(error: Exception) -> Optional[str]:
+    """Why a failed send is worth retrying, or None if it isn't (e.g. missing permissions)."""
+    status = getattr(error, 'status', None)
+    if status == 429:
+        return 'rate_limit'
+    if status is not None and status >= 500:
+        return 'server_error'
+    if isinstance(error, (asyncio.TimeoutError, OSError)):
+        return 'network'
+    return None
+
+
+class Dispatcher:
+    """Per-channel outbound queues with coalescing, rate limiting and retries."""
+
+    def __init__(self, channel_rate: Tuple[int, float] = CHANNEL_RATE, global_rate: Tuple[int, float] = GLOBAL_RATE,
+                 max_retries: int = 5, base_backoff: float = 0.5, max_backoff: float = 30.0,
+                 max_pending: int = 1000):
+        self.channel_rate = channel_rate
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self._global = TokenBucket(*global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[Pending]] = {}
+        self._workers: Dict[int, "asyncio.Task"] = {}
+        REGISTRY.gauge('binky_dispatch_queue_depth', "Outbound messages waiting to be sent.", self.pending)
+
+    def send(self, channel, content: str) -> "asyncio.Future":
+        """Queue content for channel and return at once.
+
+        The returned future resolves to the sent discord message (shared by
+        messages that were joined), or to the error if the send was given up
+        on. Awaiting it is optional; failures are logged either way.
+        """
+        future = asyncio.get_event_loop().create_future()
+        queue = self._queues.setdefault(channel.id, deque())
+        if len(queue) >= self.max_pending:
+            logger.warning(f"Outbound queue for channel {channel.id} is full, dropping message")
+            SEND_FAILURES.labels().inc()
+            self._fail([future], asyncio.QueueFull())
+            return future
+
+        queue.append((content, future))
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.ensure_future(self._drain(channel))
+        return future
+
+    def pending(self) -> int:
+        """Messages queued across all channels."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def close(self) -> None:
+        """Stop delivering; anything still queued is dropped."""
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        for queue in self._queues.values():
+            for _, future in queue:
+                future.cancel()
+        self._queues.clear()
+
+    async def _drain(self, channel) -> None:
+        """Worker: deliver channel's queue in order, then exit."""
+        queue = self._queues[channel.id]
+        bucket = self._buckets.get(channel.id)
+        if bucket is None:
+            bucket = self._buckets[channel.id] = TokenBucket(*self.channel_rate)
+        try:
+            while queue:
+                # Taking messages only once a send is allowed lets more of them coalesce
+                await bucket.acquire()
+                await self._global.acquire()
+                content, futures = self._take(queue)
+                await self._deliver(channel, bucket, content, futures)
+        finally:
+            self._workers.pop(channel.id, None)
+
+    def _take(self, queue: Deque[Pending]) -> Tuple[str, List["asyncio.Future"]]:
+        """Pop the next message and join the ones behind it while they fit in one."""
+        content, future = queue.popleft()
+        futures = [future]
+        while queue and len(content) + 1 + len(queue[0][0]) <= MAX_MESSAGE_LENGTH:
+            following, future = queue.popleft()
+            content = f"{content}\n{following}"
+            futures.append(future)
+        if len(futures) > 1:
+            MESSAGES_COALESCED.labels().inc(len(futures) - 1)
+        return content, futures
+
+    async def _deliver(self, channel, bucket: TokenBucket, content: str, futures: List["asyncio.Future"]) -> None:
+        """Send one message, retrying rate limits and transient errors."""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await bucket.acquire()
+                await self._global.acquire()
+            try:
+                message = await channel.send(content)
+            except Exception as e:
+                reason = _retry_reason(e)
+                if reason is None or attempt == self.max_retries:
+                    logger.error(f"Giving up on message to channel {channel.id} after {attempt + 1} attempts: {e!r}")
+                    SEND_FAILURES.labels().inc(len(futures))
+                    self._fail(futures, e)
+                    return
+                # Full jitter on top of any wait the server asked for, which the
+                # channel's bucket enforces for queued messages too
+                delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+                retry_after = getattr(e, 'retry_after', None)
+                if reason == 'rate_limit' and retry_after:
+                    bucket.pause(retry_after)
+                SEND_RETRIES.labels(reason).inc()
+                logger.warning(f"Send to channel {channel.id} failed ({reason}), retrying in "
+                               f"{delay + (retry_after or 0):.2f}s")
+                await asyncio.sleep(delay)
+            else:
+                MESSAGES_SENT.labels().inc()
+                for future in futures:
+                    if not future.done():
+                        future.set_result(message)
+                return
+
+    @staticmethod
+    def _fail(futures: List["asyncio.Future"], error: BaseException) -> None:
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+                # Already logged; don't warn again about callers that never await it
+                future.exception()
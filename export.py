@@ -0,0 +1,158 @@
+"""Online snapshots and streaming, week-partitioned exports of activity data.
+
+Exports go to out_dir/<table>/, one partition per closed (Monday to Sunday,
+UTC) week, streamed from a read-only connection chunk_size rows at a time so
+memory use stays flat however long the history is:
+
+    csv  <table>-<monday>.csv.gz, one gzipped CSV with a header row per week
+    npz  <table>-<monday>-partNNNN.npz, compressed column arrays per chunk (needs numpy)
+
+out_dir/watermarks.json records the last week exported per table, so a run only
+writes the weeks closed since the previous one. The current week is never
+exported, so a written partition is final. Weeks that later gain rows (e.g.
+from binky!backfill) are only rewritten by a full export.
+
+Compaction moves raw activity into activity_daily a day at a time, so a week
+can be split between them. Raw tables are exported from the compaction cutoff
+on: the week it falls in gets a partition with just the days still raw. An
+activity_daily week is only exported once it is compacted in full, so its
+partition is final too.
+"""
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from database import EXPORT_TABLES, Database, week_start
+
+logger = logging.getLogger('binky.export')
+
+NPZ_AVAILABLE = np is not None
+
+EXPORT_DIR = 'exports'
+SNAPSHOT_DIR = 'backups'
+EXPORT_CHUNK_SIZE = 50000
+WATERMARKS_FILE = 'watermarks.json'
+FORMATS = ('csv', 'npz')
+
+
+def default_paths(db: Database) -> Tuple[str, str]:
+    """(export directory, timestamped snapshot path) for a database, named after its file."""
+    name = os.path.splitext(os.path.basename(db.db_path))[0]
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    return os.path.join(EXPORT_DIR, name), os.path.join(SNAPSHOT_DIR, f"{name}-{stamp}.db")
+
+
+def load_watermarks(out_dir: str) -> Dict[str, date]:
+    """Last exported week per table."""
+    path = os.path.join(out_dir, WATERMARKS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {table: date.fromisoformat(week) for table, week in json.load(f).items()}
+
+
+def _save_watermarks(out_dir: str, watermarks: Dict[str, date]) -> None:
+    path = os.path.join(out_dir, WATERMARKS_FILE)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({table: week.isoformat() for table, week in sorted(watermarks.items())}, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def export_activity(db: Database, out_dir: str, fmt: str = 'csv', tables: Optional[Sequence[str]] = None,
+                    full: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE,
+                    today: Optional[date] = None) -> Dict[str, int]:
+    """Export closed weeks not exported yet (every closed week, with full). Returns rows written per table."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'npz' and not NPZ_AVAILABLE:
+        raise RuntimeError("npz export needs numpy")
+    if not db.timestamps_migrated('export'):
+        return {}
+    tables = list(tables or EXPORT_TABLES)
+    unknown = set(tables) - set(EXPORT_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+
+    current_week = week_start(today or datetime.utcnow().date())
+    watermarks = load_watermarks(out_dir)
+    if full:
+        watermarks = {t: w for t, w in watermarks.items() if t not in tables}
+    written = {}
+    for table in tables:
+        directory = os.path.join(out_dir, table)
+        os.makedirs(directory, exist_ok=True)
+        columns = EXPORT_TABLES[table][1]
+        rows = 0
+        compacted_before = date.fromisoformat(db.compacted_before) if db.compacted_before else None
+        for week in db.export_weeks(table):
+            if table == 'activity_daily' and (compacted_before is None or week + timedelta(days=7) > compacted_before):
+                break  # still being compacted into
+            if week >= current_week or (table in watermarks and week <= watermarks[table]):
+                continue
+            since = None
+            if table != 'activity_daily' and compacted_before is not None:
+                if week + timedelta(days=7) <= compacted_before:
+                    continue  # all in activity_daily
+                since = compacted_before
+            _remove_partition(directory, table, week)
+            chunks = db.iter_export(table, week, chunk_size, since)
+            if fmt == 'csv':
+                rows += _write_csv(os.path.join(directory, f"{table}-{week.isoformat()}.csv.gz"), columns, chunks)
+            else:
+                rows += _write_npz(os.path.join(directory, f"{table}-{week.isoformat()}"), columns, chunks)
+            # Saved per week so an interrupted export resumes where it stopped
+            watermarks[table] = week
+            _save_watermarks(out_dir, watermarks)
+        written[table] = rows
+        logger.info(f"Exported {rows} {table} rows to {directory}")
+    return written
+
+
+def _remove_partition(directory: str, table: str, week: date) -> None:
+    """Delete any files of a week's partition, e.g. parts left by an interrupted export."""
+    prefix = f"{table}-{week.isoformat()}"
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            os.remove(os.path.join(directory, name))
+
+
+def _write_csv(path: str, columns: Sequence[str], chunks: Iterable[List[Tuple]]) -> int:
+    rows = 0
+    with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    os.replace(f"{path}.tmp", path)
+    return rows
+
+
+def _write_npz(stem: str, columns: Sequence[str], chunks: Iterable[List[Tuple]]) -> int:
+    rows = 0
+    for part, chunk in enumerate(chunks):
+        arrays = {name: _column(values) for name, values in zip(columns, zip(*chunk))}
+        # savez appends .npz unless the name already ends with it
+        np.savez_compressed(f"{stem}-part{part:04d}.tmp.npz", **arrays)
+        os.replace(f"{stem}-part{part:04d}.tmp.npz", f"{stem}-part{part:04d}.npz")
+        rows += len(chunk)
+    return rows
+
+
+def _column(values: Tuple) -> "np.ndarray":
+    """Array for one column. NULLs become 0 (the unknown channel) or '' so nothing needs pickling."""
+    array = np.array(values)
+    if array.dtype != object:
+        return array
+    if any(isinstance(v, str) for v in values):
+        return np.array(['' if v is None else v for v in values], dtype=str)
+    return np.array([0 if v is None else v for v in values])
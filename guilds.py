@@ -0,0 +1,144 @@
+"""Per-guild configuration and the trackers that serve each guild.
+
+Every configured guild gets its own SQLite file, writer thread and standings, so
+a busy guild never holds the write lock or fills the ingest queue of another.
+
+guilds.json lists the guilds this process serves:
+
+    {
+        "guilds": [
+            {"guild_id": 123, "channel_id": 456, "ranked_channels": [456, 789]},
+            {"guild_id": 321, "channel_id": 654, "ranked_channels": [], "db_path": "other.db",
+             "scoring": {"reactions": [0.5, 0.2], "channel_multipliers": {"654": 2.0},
+                         "hour_multipliers": {"20": 1.5}, "timezone": "America/Los_Angeles"}}
+        ]
+    }
+
+db_path defaults to binky_<guild_id>.db. scoring takes the fields of
+scoring.ScoringRules; anything left out keeps its default. Without guilds.json the bot runs as a
+single community with the default configuration for every guild.
+"""
+import json
+import logging
+import os
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from discord.ext import commands
+
+import analytics
+from activity_tracker import ActivityTracker, PingManager
+from analytics import AnalyticsEngine
+from async_database import AsyncDatabase
+from database import Database
+from dispatcher import Dispatcher
+from scoring import DEFAULT_RULES, ScoringRules
+
+logger = logging.getLogger('binky.guilds')
+
+GUILDS_FILE = 'guilds.json'
+
+
+class GuildConfig(NamedTuple):
+    guild_id: Optional[int]  # None serves every guild without its own entry
+    channel_id: int          # announcements, daily messages and pings
+    ranked_channels: Tuple[int, ...]
+    db_path: str
+    scoring: ScoringRules = DEFAULT_RULES
+
+
+def load_guild_configs(path: str, default: GuildConfig) -> List[GuildConfig]:
+    """Read guild configuration from path, falling back to the single default guild."""
+    if not os.path.exists(path):
+        logger.info(f"No {path}; serving every guild from {default.db_path}")
+        return [default]
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)['guilds']
+    configs = []
+    for entry in entries:
+        guild_id = int(entry['guild_id'])
+        configs.append(GuildConfig(
+            guild_id=guild_id,
+            channel_id=int(entry['channel_id']),
+            ranked_channels=tuple(int(c) for c in entry.get('ranked_channels', ())),
+            db_path=entry.get('db_path', f"binky_{guild_id}.db"),
+            scoring=ScoringRules.from_dict(entry.get('scoring', {})),
+        ))
+    if len({c.db_path for c in configs}) != len(configs):
+        raise ValueError(f"Guilds in {path} must not share a db_path")
+    logger.info(f"Loaded {len(configs)} guilds from {path}")
+    return configs
+
+
+class GuildContext:
+    """The database, activity tracker, ping manager and analytics of one guild."""
+
+    def __init__(self, bot: commands.Bot, config: GuildConfig, dispatcher: Dispatcher):
+        self.config = config
+        self.db = Database(config.db_path, guild_id=config.guild_id, rules=config.scoring)
+        # Awaitable queries for coroutines, on a thread pool sized to the reader pool
+        self.async_db = AsyncDatabase(self.db)
+        self.tracker = ActivityTracker(bot, self.db, channel_id=config.channel_id, dispatcher=dispatcher,
+                                       async_db=self.async_db)
+        self.tracker.set_ranked_channels(list(config.ranked_channels))
+        self.ping_manager = PingManager(self.db, bot, config.channel_id, dispatcher, self.async_db)
+        # Optional: needs numpy
+        self.analytics = AnalyticsEngine(self.db) if analytics.AVAILABLE else None
+
+    def set_rules(self, rules: ScoringRules) -> None:
+        """Score new activity with rules; stored points change on the next Database.rescore()."""
+        self.config = self.config._replace(scoring=rules)
+        self.db.set_rules(rules)
+
+    def start(self) -> None:
+        self.tracker.start_tasks()
+        self.ping_manager.start()
+
+    def close(self) -> None:
+        """Stop background tasks and flush queued activity."""
+        self.ping_manager.ping_check_loop.cancel()
+        self.tracker.cog_unload()
+        self.async_db.close()
+        self.db.close()
+
+
+class GuildRouter:
+    """Routes discord objects to the context of the guild they belong to.
+
+    Anything with a .guild attribute (messages, channels, command contexts) can
+    be routed, so tests can pass stand-in objects.
+    """
+
+    def __init__(self, bot: commands.Bot, configs: List[GuildConfig], dispatcher: Dispatcher):
+        self.bot = bot
+        self.configs = configs
+        # Shared so every guild's sends count against the same global rate limit
+        self.dispatcher = dispatcher
+        self._contexts: Dict[Optional[int], GuildContext] = {}
+
+    @property
+    def started(self) -> bool:
+        return bool(self._contexts)
+
+    def start(self) -> None:
+        """Open every guild's database and start its background tasks. Idempotent."""
+        if self.started:
+            return
+        for config in self.configs:
+            context = GuildContext(self.bot, config, self.dispatcher)
+            self._contexts[config.guild_id] = context
+            context.start()
+
+    def get(self, obj) -> Optional[GuildContext]:
+        """The context serving obj's guild, or None for DMs and unconfigured guilds."""
+        guild = getattr(obj, 'guild', None)
+        if guild is None:
+            return None
+        return self._contexts.get(guild.id) or self._contexts.get(None)
+
+    def __iter__(self) -> Iterator[GuildContext]:
+        return iter(list(self._contexts.values()))
+
+    def close(self) -> None:
+        for context in self:
+            context.close()
+        self._contexts.clear()
@@ -0,0 +1,152 @@
+import logging
+import queue
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from database import Database
+from metrics import REGISTRY, EVENTS_INGESTED, EVENTS_DROPPED
+from models import Event
+
+logger = logging.getLogger('binky.ingest')
+
+# What put() does when the queue is full
+OVERFLOW_BLOCK = 'block'              # wait up to put_timeout, then drop the new events
+OVERFLOW_DROP_NEWEST = 'drop_newest'  # drop the new events immediately
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # evict the oldest queued events to make room
+
+_STOP = object()
+
+
+class IngestQueue:
+    """Write-behind pipeline between the discord handlers and the database.
+
+    Handlers push small event records with put(); a dedicated writer thread drains
+    the queue in micro-batches and commits each batch in a single transaction.
+    """
+
+    def __init__(self, db: Database, batch_size: int = 200, flush_interval: float = 0.5,
+                 max_size: int = 10000, overflow: str = OVERFLOW_BLOCK, put_timeout: float = 0.05):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_size)
+        self._thread: Optional[threading.Thread] = None
+        REGISTRY.gauge('binky_ingest_queue_depth', "Gateway events waiting for the writer.", self.qsize,
+                       'guild', db.metrics_label)
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        if self._thread is None:
+            name = f"binky-ingest-{self.db.guild_id}" if self.db.guild_id is not None else 'binky-ingest'
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+
+    def put(self, events: Sequence[Event]) -> bool:
+        """Queue the events produced by one gateway event. Returns False if they were dropped."""
+        item = tuple(events)
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self._queue.put(item, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(item)
+            self._count_ingested(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            try:
+                evicted = self._queue.get_nowait()
+                self._count_dropped(evicted)
+                self._queue.put_nowait(item)
+                self._count_ingested(item)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+        self._count_dropped(item)
+        return False
+
+    def qsize(self) -> int:
+        """Number of gateway events waiting to be written."""
+        return self._queue.qsize()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Flush everything still queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @staticmethod
+    def _count_ingested(item) -> None:
+        for event in item:
+            EVENTS_INGESTED.labels(type(event).__name__).inc()
+
+    def _count_dropped(self, item) -> None:
+        self.dropped += len(item)
+        EVENTS_DROPPED.labels().inc(len(item))
+        logger.warning(f"Ingest queue full, dropped {len(item)} events ({self.dropped} total)")
+
+    def _run(self) -> None:
+        """Writer thread: collect micro-batches and write them until stopped."""
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch: List[Tuple[Event, ...]] = []
+            count = 0
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                count += len(item)
+                if count >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if stopping:
+                # Drain whatever was queued behind the stop marker
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Tuple[Event, ...]]) -> None:
+        """Write a batch, falling back to one gateway event at a time if the batch fails."""
+        events = [event for item in batch for event in item]
+        try:
+            self.db.record_batch(events)
+            self.written += len(events)
+            return
+        except Exception:
+            logger.exception(f"Failed to write batch of {len(events)} events, retrying individually")
+
+        for item in batch:
+            try:
+                self.db.record_batch(item)
+                self.written += len(item)
+            except Exception:
+                logger.exception(f"Failed to write events {item!r}")
@@ -0,0 +1,117 @@
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from database import Award, Database
+from models import Event, UserEvent
+from scoring import SCORE_EPSILON
+
+logger = logging.getLogger('binky.leaderboard')
+
+
+class Leaderboard:
+    """Rolling-window standings kept in memory and updated as points are committed.
+
+    Points are bucketed by UTC day, so a day's points drop out as a unit when it
+    leaves the window. Standings are a sorted list of (-score, user_id): top-N is
+    a slice and a user's rank is a bisect.
+    """
+
+    def __init__(self, db: Database, days: int = 7):
+        self.db = db
+        self.days = days
+        self._lock = threading.Lock()
+        self._daily: Dict[str, Dict[int, float]] = {}
+        self._scores: Dict[int, float] = {}
+        self._names: Dict[int, str] = {}
+        self._sorted: List[Tuple[float, int]] = []
+        self._window_start = ''
+
+    def _window_start_day(self) -> date:
+        return datetime.utcnow().date() - timedelta(days=self.days - 1)
+
+    def reconcile(self) -> None:
+        """Rebuild the standings from the daily rollup in the database."""
+        start = self._window_start_day()
+        # Holding the write lock means no batch can commit (and notify us) between
+        # the read and the swap, so nothing is counted twice or missed. Our own lock
+        # is only taken for the swap, so top() and rank() don't wait on the query.
+        with self.db.writer():
+            rows = self.db.get_daily_scores(start)
+            daily: Dict[str, Dict[int, float]] = {}
+            scores: Dict[int, float] = {}
+            names: Dict[int, str] = {}
+            for user_id, username, day, points in rows:
+                names[user_id] = username
+                daily.setdefault(day, {})
+                daily[day][user_id] = daily[day].get(user_id, 0.0) + points
+                scores[user_id] = scores.get(user_id, 0.0) + points
+            ranked = sorted((-score, user_id) for user_id, score in scores.items() if score > SCORE_EPSILON)
+            with self._lock:
+                drift = self._scores
+                self._names.update(names)
+                self._daily, self._scores, self._sorted = daily, scores, ranked
+                self._window_start = start.isoformat()
+        changed = sum(1 for user_id, score in scores.items()
+                      if abs(drift.get(user_id, 0.0) - score) > 1e-6)
+        if changed:
+            logger.info(f"Leaderboard reconciled: {changed} scores corrected")
+
+    def apply(self, events: Sequence[Event], awards: List[Award]) -> None:
+        """Database listener: add the points from a committed batch."""
+        with self._lock:
+            for event in events:
+                if isinstance(event, UserEvent):
+                    self._names[event.user_id] = event.username
+            self._expire()
+            for user_id, day, points in awards:
+                if day < self._window_start:
+                    continue  # backfilled history outside the window
+                bucket = self._daily.setdefault(day, {})
+                bucket[user_id] = bucket.get(user_id, 0.0) + points
+                self._set_score(user_id, self._scores.get(user_id, 0.0) + points)
+
+    def top(self, n: int) -> List[Tuple[int, str, float]]:
+        """The n highest scores as (user_id, username, score)."""
+        with self._lock:
+            self._expire()
+            return [(user_id, self._names.get(user_id, str(user_id)), -neg_score)
+                    for neg_score, user_id in self._sorted[:n]]
+
+    def rank(self, user_id: int) -> Optional[Tuple[int, float, int]]:
+        """(rank, score, ranked users) for a user, or None if they have no points.
+
+        Tied users share the better rank.
+        """
+        with self._lock:
+            self._expire()
+            score = self._scores.get(user_id, 0.0)
+            if score <= SCORE_EPSILON:
+                return None
+            position = bisect_left(self._sorted, (-score, float('-inf')))
+            return position + 1, score, len(self._sorted)
+
+    def _expire(self) -> None:
+        """Drop days that have left the window. Caller holds the lock."""
+        window_start = self._window_start_day().isoformat()
+        if window_start == self._window_start:
+            return
+        self._window_start = window_start
+        for day in [d for d in self._daily if d < window_start]:
+            for user_id, points in self._daily.pop(day).items():
+                self._set_score(user_id, self._scores.get(user_id, 0.0) - points)
+
+    def _set_score(self, user_id: int, score: float) -> None:
+        """Move a user to their new position in the sorted standings. Caller holds the lock."""
+        old = self._scores.get(user_id, 0.0)
+        if old > SCORE_EPSILON:
+            i = bisect_left(self._sorted, (-old, user_id))
+            if i < len(self._sorted) and self._sorted[i] == (-old, user_id):
+                del self._sorted[i]
+        if score > SCORE_EPSILON:
+            self._scores[user_id] = score
+            insort(self._sorted, (-score, user_id))
+        else:
+            self._scores.pop(user_id, None)
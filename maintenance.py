@@ -0,0 +1,134 @@
+"""Offline maintenance commands for the Binky database.
+
+Usage:
+    python maintenance.py [--db binky_bot.db] rebuild-rollup
+    python maintenance.py [--db binky_bot.db] migrate-timestamps
+    python maintenance.py [--db binky_bot.db] repair-activity
+    python maintenance.py [--db binky_bot.db] compact [--days 90]
+    python maintenance.py [--db binky_bot.db] vacuum
+    python maintenance.py [--db binky_bot.db] recompute-streaks
+    python maintenance.py [--db binky_bot.db] rescore --rules rules.json
+    python maintenance.py [--db binky_bot.db] snapshot [--out backup.db]
+    python maintenance.py [--db binky_bot.db] export [--out exports/binky_bot] [--format csv|npz] [--full]
+"""
+import argparse
+import logging
+import os
+
+from database import EXPORT_TABLES, Database, RETENTION_DAYS
+from export import FORMATS, default_paths, export_activity
+from scoring import load_rules
+
+logger = logging.getLogger('binky.maintenance')
+
+
+def rebuild_rollup(db: Database, args: argparse.Namespace) -> None:
+    """Rebuild the per-user daily score rollup from the raw activity tables."""
+    rows = db.rebuild_daily_scores()
+    logger.info(f"Rebuilt user_daily_scores: {rows} rows")
+
+
+def migrate_timestamps(db: Database, args: argparse.Namespace) -> None:
+    """Convert legacy datetime text timestamps to epoch milliseconds."""
+    rows = db.migrate_timestamps()
+    logger.info(f"Converted {rows} timestamps")
+
+
+def repair_activity(db: Database, args: argparse.Namespace) -> None:
+    """Check users.last_message_at / last_pinged_at against the raw tables and fix them."""
+    users = db.repair_activity_columns()
+    logger.info(f"Repaired last activity columns for {users} users")
+
+
+def compact(db: Database, args: argparse.Namespace) -> None:
+    """Compact raw activity older than the retention window into daily totals."""
+    rows = db.compact_activity(args.days)
+    logger.info(f"Compacted {rows} rows")
+
+
+def vacuum(db: Database, args: argparse.Namespace) -> None:
+    """Rebuild the database file and enable incremental vacuum (blocks writers)."""
+    db.vacuum()
+    logger.info("Vacuum complete")
+
+
+def recompute_streaks(db: Database, args: argparse.Namespace) -> None:
+    """Rebuild current and longest streaks from message history."""
+    users = db.recompute_streaks()
+    logger.info(f"Recomputed streaks for {users} users")
+
+
+def rescore(db: Database, args: argparse.Namespace) -> None:
+    """Recompute stored message, reaction and mention points with new scoring rules."""
+    db.set_rules(load_rules(args.rules))
+    rows = db.rescore()
+    logger.info(f"Rescored {rows} rows")
+
+
+def snapshot(db: Database, args: argparse.Namespace) -> None:
+    """Copy a consistent snapshot of the database while the bot keeps running."""
+    path = args.out or default_paths(db)[1]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    pages = db.snapshot(path)
+    logger.info(f"Wrote {pages} pages to {path}")
+
+
+def export(db: Database, args: argparse.Namespace) -> None:
+    """Export closed weeks of activity not exported yet to compressed weekly partitions."""
+    out = args.out or default_paths(db)[0]
+    written = export_activity(db, out, args.format, args.tables, full=args.full)
+    logger.info(f"Exported {sum(written.values())} rows to {out}")
+
+
+COMMANDS = {
+    'rebuild-rollup': rebuild_rollup,
+    'migrate-timestamps': migrate_timestamps,
+    'repair-activity': repair_activity,
+    'compact': compact,
+    'vacuum': vacuum,
+    'recompute-streaks': recompute_streaks,
+    'rescore': rescore,
+    'snapshot': snapshot,
+    'export': export,
+}
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Binky database maintenance")
+    parser.add_argument('--db', default='binky_bot.db', help="path to the SQLite database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild-rollup', help=rebuild_rollup.__doc__)
+    subparsers.add_parser('migrate-timestamps', help=migrate_timestamps.__doc__)
+    subparsers.add_parser('repair-activity', help=repair_activity.__doc__)
+    compact_parser = subparsers.add_parser('compact', help=compact.__doc__)
+    compact_parser.add_argument('--days', type=int, default=RETENTION_DAYS,
+                                help="keep raw activity for this many days")
+    subparsers.add_parser('vacuum', help=vacuum.__doc__)
+    subparsers.add_parser('recompute-streaks', help=recompute_streaks.__doc__)
+    rescore_parser = subparsers.add_parser('rescore', help=rescore.__doc__)
+    rescore_parser.add_argument('--rules', required=True,
+                                help="JSON file of scoring rules (the fields of scoring.ScoringRules)")
+    snapshot_parser = subparsers.add_parser('snapshot', help=snapshot.__doc__)
+    snapshot_parser.add_argument('--out', help="snapshot file (default: backups/<db name>-<UTC time>.db)")
+    export_parser = subparsers.add_parser('export', help=export.__doc__)
+    export_parser.add_argument('--out', help="export directory (default: exports/<db name>)")
+    export_parser.add_argument('--format', choices=FORMATS, default='csv',
+                               help="csv: gzipped CSV per week; npz: NumPy column arrays per chunk")
+    export_parser.add_argument('--tables', nargs='+', choices=list(EXPORT_TABLES), help="default: all")
+    export_parser.add_argument('--full', action='store_true',
+                               help="re-export every closed week, not just those since the last export")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    try:
+        COMMANDS[args.command](db, args)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Low-overhead runtime metrics with a Prometheus text export.
+
+Set BINKY_METRICS=0 to disable instrumentation entirely: instrument() then
+leaves classes untouched and every counter, gauge and histogram is a no-op.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger('binky.metrics')
+
+ENABLED = os.getenv('BINKY_METRICS', '1') != '0'
+METRICS_FILE = os.getenv('BINKY_METRICS_FILE', 'binky_metrics.prom')
+
+# Latency buckets in seconds, from 100µs to 5s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label_text(label: Optional[str], value: Optional[str], extra: str = '') -> str:
+    parts = [f'{label}="{value}"'] if label else []
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        if ENABLED:
+            with self._lock:
+                self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        if ENABLED:
+            i = bisect_left(self.buckets, value)
+            with self._lock:
+                self.counts[i] += 1
+                self.sum += value
+                self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating inside its bucket."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Family:
+    """A metric with one child per value of a single label."""
+
+    def __init__(self, kind: str, name: str, help_text: str, label: Optional[str], factory: Callable):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._factory = factory
+        self._children: Dict[Optional[str], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value: Optional[str] = None):
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, self._factory())
+        return child
+
+    def children(self) -> List[Tuple[Optional[str], object]]:
+        with self._lock:
+            return sorted(self._children.items(), key=lambda item: str(item[0]))
+
+
+class Registry:
+    def __init__(self):
+        self._families: Dict[str, Family] = {}
+        self._gauges: Dict[Tuple[str, Optional[str]], Tuple[str, Optional[str], Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+
+    def _family(self, kind: str, name: str, help_text: str, label: Optional[str], factory: Callable) -> Family:
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = Family(kind, name, help_text, label, factory)
+            return family
+
+    def counter(self, name: str, help_text: str, label: Optional[str] = None) -> Family:
+        return self._family('counter', name, help_text, label, Counter)
+
+    def histogram(self, name: str, help_text: str, label: Optional[str] = None) -> Family:
+        return self._family('histogram', name, help_text, label, Histogram)
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float],
+              label: Optional[str] = None, value: Optional[str] = None) -> None:
+        """Register a gauge that is read when metrics are exported.
+
+        Gauges registered under the same name with different label values are
+        exported as one metric; re-registering a label value replaces it.
+        """
+        with self._lock:
+            self._gauges[(name, value)] = (help_text, label, read)
+
+    def _read_gauges(self) -> Iterable[Tuple[str, str, Optional[str], Optional[str], Optional[float]]]:
+        with self._lock:
+            gauges = sorted(self._gauges.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        for (name, value), (help_text, label, read) in gauges:
+            try:
+                yield name, help_text, label, value, float(read())
+            except Exception:
+                yield name, help_text, label, value, None
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            name = f"{family.name}_total" if family.kind == 'counter' else family.name
+            lines.append(f"# HELP {name} {family.help}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for value, child in family.children():
+                labels = _label_text(family.label, value)
+                if isinstance(child, Counter):
+                    lines.append(f"{name}{labels} {child.value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(child.buckets) + ['+Inf'], child.counts):
+                    cumulative += count
+                    le = _label_text(family.label, value, f'le="{bound}"')
+                    lines.append(f"{family.name}_bucket{le} {cumulative}")
+                lines.append(f"{family.name}_sum{labels} {child.sum}")
+                lines.append(f"{family.name}_count{labels} {child.count}")
+        described = set()
+        for name, help_text, label, value, reading in self._read_gauges():
+            if reading is None:
+                continue
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_label_text(label if value is not None else None, value)} {reading}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> List[str]:
+        """Human-readable one-line-per-series summary for binky!perf."""
+        lines: List[str] = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            for value, child in family.children():
+                name = f"{family.name}[{value}]" if value is not None else family.name
+                if isinstance(child, Counter):
+                    lines.append(f"{name}: {child.value}")
+                elif child.count:
+                    lines.append(f"{name}: n={child.count} avg={child.sum / child.count * 1000:.2f}ms "
+                                 f"p50={child.quantile(0.5) * 1000:.2f}ms p99={child.quantile(0.99) * 1000:.2f}ms")
+        for name, _, _, value, reading in self._read_gauges():
+            name = f"{name}[{value}]" if value is not None else name
+            lines.append(f"{name}: {reading}")
+        return lines
+
+
+REGISTRY = Registry()
+
+DB_CALL_SECONDS = REGISTRY.histogram('binky_db_call_seconds', "Database method latency.", 'method')
+EVENTS_INGESTED = REGISTRY.counter('binky_events_ingested', "Events accepted by the ingest queue.", 'type')
+EVENTS_DROPPED = REGISTRY.counter('binky_events_dropped', "Events dropped because the ingest queue was full.")
+EVENTS_DUPLICATE = REGISTRY.counter('binky_events_duplicate', "Replayed or duplicate events skipped by ingest.", 'type')
+LOOP_LAG_SECONDS = REGISTRY.histogram('binky_event_loop_lag_seconds', "Event loop scheduling delay.")
+
+
+def instrument(histogram: Family, exclude: Iterable[str] = ()) -> Callable[[type], type]:
+    """Class decorator timing every public method into histogram, labelled by method name."""
+    skip = set(exclude)
+
+    def decorate(cls: type) -> type:
+        if not ENABLED:
+            return cls
+        for name, attr in list(vars(cls).items()):
+            if name.startswith('_') or name in skip or not callable(attr):
+                continue
+            setattr(cls, name, _timed(attr, histogram.labels(name)))
+        return cls
+    return decorate
+
+
+def _timed(fn: Callable, child: Histogram) -> Callable:
+    if inspect.isgeneratorfunction(fn):
+        return _timed_generator(fn, child)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_generator(fn: Callable, child: Histogram) -> Callable:
+    """Time a generator by its own work summed over all steps, leaving out the consumer's time between steps."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        elapsed = 0.0
+        generator = fn(*args, **kwargs)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        except StopIteration:
+            return
+        finally:
+            generator.close()
+            child.observe(elapsed)
+    return wrapper
+
+
+class MetricsReporter:
+    """Background tasks: event loop lag sampling and the periodic metrics file."""
+
+    def __init__(self, path: str = METRICS_FILE, write_interval: float = 15.0, lag_interval: float = 0.5):
+        self.path = path
+        self.write_interval = write_interval
+        self.lag_interval = lag_interval
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if ENABLED and not self._tasks:
+            self._tasks = [
+                asyncio.ensure_future(self._sample_lag()),
+                asyncio.ensure_future(self._write_periodically()),
+            ]
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _sample_lag(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            LOOP_LAG_SECONDS.labels().observe(max(0.0, loop.time() - start - self.lag_interval))
+
+    async def _write_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.write_interval)
+            try:
+                self.write()
+            except OSError:
+                logger.exception(f"Failed to write metrics to {self.path}")
+
+    def write(self) -> None:
+        """Atomically replace the metrics file so scrapers never see a partial write."""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(REGISTRY.render_prometheus())
+        os.replace(tmp, self.path)
@@ -0,0 +1,272 @@
+"""Versioned schema migrations.
+
+schema.sql is the complete current schema and is applied as-is to new
+databases. Databases created before a change are brought up to date by the
+numbered migrations below; schema_version records how far a database has got
+and a fingerprint of the schema.sql it was last checked against. Opening a
+database that is already current costs a single SELECT.
+
+To change the schema, edit schema.sql and append a migration that makes the
+same change to existing databases. Migrations also run on databases from
+before schema_version existed, so each one must be safe to re-apply.
+"""
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger('binky.migrations')
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# SQL for the UTC day of a timestamp stored either as epoch ms or as datetime text
+_DAY = "CASE WHEN typeof(timestamp) = 'integer' THEN date(timestamp / 1000, 'unixepoch') ELSE date(timestamp) END"
+
+
+@functools.lru_cache(maxsize=None)
+def load_schema() -> Tuple[Tuple[str, ...], str]:
+    """The statements in schema.sql and a fingerprint of the file. Read once per process."""
+    with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+        text = f.read()
+    statements, pending = [], ''
+    for line in text.splitlines(keepends=True):
+        pending += line
+        if sqlite3.complete_statement(pending):
+            statements.append(pending.strip())
+            pending = ''
+    return tuple(statements), hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _add_daily_scores(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_scores (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            message_points REAL NOT NULL DEFAULT 0,
+            reaction_points REAL NOT NULL DEFAULT 0,
+            mention_points REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_daily_scores_day ON user_daily_scores(day)")
+    if conn.execute("SELECT 1 FROM user_daily_scores LIMIT 1").fetchone():
+        return
+    conn.execute(f"""
+        INSERT INTO user_daily_scores (user_id, day, message_points, reaction_points, mention_points)
+        SELECT user_id, day, SUM(message_points), SUM(reaction_points), SUM(mention_points)
+        FROM (
+            SELECT user_id, {_DAY} as day, points as message_points, 0 as reaction_points, 0 as mention_points
+            FROM messages
+            UNION ALL
+            SELECT reactor_id, {_DAY}, 0, points, 0 FROM reactions
+            UNION ALL
+            SELECT mentioned_user_id, {_DAY}, 0, 0, points FROM mentions
+        )
+        GROUP BY user_id, day
+    """)
+
+
+def _add_db_meta(conn: sqlite3.Connection) -> None:
+    # No timestamp_format row: existing databases keep datetime text until migrated
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+
+
+def _add_activity_indexes(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reactions_message_reactor ON reactions(message_id, reactor_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reactions_timestamp ON reactions(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mentions_timestamp ON mentions(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_member_pings_timestamp ON member_pings(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_member_pings_user ON member_pings(user_id, timestamp)")
+    # Prefix of idx_reactions_message_reactor
+    conn.execute("DROP INDEX IF EXISTS idx_reactions_message")
+
+
+def _add_backfill_checkpoints(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            channel_id INTEGER PRIMARY KEY,
+            last_message_id INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+
+
+def _add_user_activity_columns(conn: sqlite3.Connection) -> None:
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    missing = [name for name in ('last_message_at', 'last_pinged_at') if name not in columns]
+    for name in missing:
+        conn.execute(f"ALTER TABLE users ADD COLUMN {name} INTEGER")
+    if missing:
+        conn.execute("""
+            UPDATE users SET
+                last_message_at = (SELECT MAX(timestamp) FROM messages m WHERE m.user_id = users.user_id),
+                last_pinged_at = (SELECT MAX(timestamp) FROM member_pings p WHERE p.user_id = users.user_id)
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users(last_message_at, last_pinged_at)")
+
+
+def _add_activity_daily(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            ranked_messages INTEGER NOT NULL DEFAULT 0,
+            reactions INTEGER NOT NULL DEFAULT 0,
+            mentions INTEGER NOT NULL DEFAULT 0,
+            message_points REAL NOT NULL DEFAULT 0,
+            reaction_points REAL NOT NULL DEFAULT 0,
+            mention_points REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, channel_id, day),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_daily_day ON activity_daily(day)")
+
+
+def _add_longest_streak(conn: sqlite3.Connection) -> None:
+    # Database.recompute_streaks() fills in the real value from history
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if 'longest_streak' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN longest_streak INTEGER DEFAULT 0")
+        conn.execute("UPDATE users SET longest_streak = COALESCE(current_streak, 0)")
+
+
+def _add_weekly_snapshots(conn: sqlite3.Connection) -> None:
+    # Past weeks are snapshotted from the rollup by Database.close_weeks()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_closes (
+            week_start DATE PRIMARY KEY,
+            users INTEGER NOT NULL,
+            total_points REAL NOT NULL,
+            closed_at INTEGER NOT NULL,
+            announced_at INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_snapshots (
+            week_start DATE NOT NULL,
+            position INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (week_start, position)
+        ) WITHOUT ROWID
+    """)
+
+
+def _add_natural_keys(conn: sqlite3.Connection) -> None:
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(reactions)")}
+    if 'emoji' not in columns:
+        conn.execute("ALTER TABLE reactions ADD COLUMN emoji TEXT")
+
+    # Replayed mentions were stored (and scored) more than once; keep the first
+    duplicates = """
+        FROM mentions WHERE id NOT IN (SELECT MIN(id) FROM mentions GROUP BY message_id, mentioned_user_id)
+    """
+    excess = conn.execute(f"SELECT mentioned_user_id, {_DAY}, SUM(points) {duplicates} GROUP BY 1, 2").fetchall()
+    if excess:
+        conn.executemany("""
+            UPDATE user_daily_scores SET mention_points = mention_points - ? WHERE user_id = ? AND day = ?
+        """, [(points, user_id, day) for user_id, day, points in excess])
+        removed = conn.execute(f"DELETE {duplicates}").rowcount
+        logger.info(f"Removed {removed} duplicate mentions")
+
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reactions_message_reactor_emoji
+        ON reactions(message_id, reactor_id, emoji)
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_mentions_message_user
+        ON mentions(message_id, mentioned_user_id)
+    """)
+    # Prefixes of the new indexes
+    conn.execute("DROP INDEX IF EXISTS idx_reactions_message_reactor")
+    conn.execute("DROP INDEX IF EXISTS idx_mentions_message")
+
+
+def _add_ranked_points(conn: sqlite3.Connection) -> None:
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(activity_daily)")}
+    if 'ranked_points' in columns:
+        return
+    conn.execute("ALTER TABLE activity_daily ADD COLUMN ranked_points REAL NOT NULL DEFAULT 0")
+    # Rows compacted so far don't say which of their reactions and mentions were
+    # on ranked messages; count a row as ranked if its channel ever had ranked messages
+    conn.execute("""
+        UPDATE activity_daily SET ranked_points = message_points + reaction_points + mention_points
+        WHERE channel_id IN (
+            SELECT channel_id FROM activity_daily WHERE ranked_messages > 0
+            UNION SELECT channel_id FROM messages WHERE is_ranked
+        )
+    """)
+
+
+# (version, description, migration), in the order they are applied
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "daily score rollup", _add_daily_scores),
+    (2, "database settings table", _add_db_meta),
+    (3, "timestamp and reactor indexes", _add_activity_indexes),
+    (4, "backfill checkpoints", _add_backfill_checkpoints),
+    (5, "users.last_message_at / last_pinged_at", _add_user_activity_columns),
+    (6, "compacted daily activity", _add_activity_daily),
+    (7, "users.longest_streak", _add_longest_streak),
+    (8, "weekly snapshots", _add_weekly_snapshots),
+    (9, "reaction emojis and unique reactions/mentions", _add_natural_keys),
+    (10, "activity_daily.ranked_points", _add_ranked_points),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> Tuple[int, str]:
+    """(version, fingerprint) recorded in the database; (0, '') if it has none."""
+    try:
+        row = conn.execute("SELECT version, fingerprint FROM schema_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return 0, ''  # no schema_version table yet
+    return (row[0], row[1]) if row else (0, '')
+
+
+def is_current(conn: sqlite3.Connection) -> bool:
+    """Whether the database is at the latest version of this schema.sql (the fast path)."""
+    return current_version(conn) == (LATEST_VERSION, load_schema()[1])
+
+
+def migrate(conn: sqlite3.Connection) -> bool:
+    """Bring the database up to date. Caller holds a write transaction.
+
+    Returns True if the database was newly created.
+    """
+    statements, fingerprint = load_schema()
+    version, stored_fingerprint = current_version(conn)
+    if (version, stored_fingerprint) == (LATEST_VERSION, fingerprint):
+        return False  # migrated by another connection meanwhile
+
+    fresh = version == 0 and not conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'
+    """).fetchone()
+    if not fresh:
+        for number, description, migration in MIGRATIONS:
+            if number > version:
+                logger.info(f"Applying migration {number}: {description}")
+                migration(conn)
+
+    # Creates everything on a new database; on an existing one it only picks up
+    # tables and indexes added to schema.sql that need no data migration
+    for statement in statements:
+        conn.execute(statement)
+    conn.execute("""
+        INSERT OR REPLACE INTO schema_version (id, version, fingerprint, updated_at)
+        VALUES (1, ?, ?, ?)
+    """, (LATEST_VERSION, fingerprint, int(time.time() * 1000)))
+    logger.info(f"Database schema at version {LATEST_VERSION}" + (" (new database)" if fresh else ""))
+    return fresh
@@ -0,0 +1,41 @@
+from datetime import datetime
+from typing import NamedTuple, Optional, Union
+
+
+# Lightweight event records pushed from the discord handlers to the ingest writer.
+
+class UserEvent(NamedTuple):
+    user_id: int
+    username: str
+
+
+class MessageEvent(NamedTuple):
+    message_id: int
+    user_id: int
+    channel_id: int
+    is_ranked: bool
+    timestamp: datetime
+
+
+class MentionEvent(NamedTuple):
+    message_id: int
+    mentioned_user_id: int
+    timestamp: datetime
+
+
+class ReactionEvent(NamedTuple):
+    message_id: int
+    reactor_id: int
+    timestamp: datetime
+    channel_id: Optional[int] = None  # the message's channel, if known
+    emoji: Optional[str] = None       # str(reaction.emoji); makes replays detectable
+
+
+class ReactionRemoveEvent(NamedTuple):
+    message_id: int
+    reactor_id: int
+    timestamp: datetime
+    emoji: Optional[str] = None
+
+
+Event = Union[UserEvent, MessageEvent, MentionEvent, ReactionEvent, ReactionRemoveEvent]
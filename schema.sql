@@ -1,48 +1,52 @@
 -- Users table to track basic user info and streaks
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     user_id INTEGER PRIMARY KEY,
     username TEXT NOT NULL,
     current_streak INTEGER DEFAULT 0,
+    longest_streak INTEGER DEFAULT 0,
     last_active DATE,
     weekly_score REAL DEFAULT 0,
-    total_score REAL DEFAULT 0
+    total_score REAL DEFAULT 0,
+    last_message_at INTEGER,  -- latest messages.timestamp for the user
+    last_pinged_at INTEGER    -- latest member_pings.timestamp for the user
 );
 
 -- Messages table to track all messages
-CREATE TABLE messages (
+CREATE TABLE IF NOT EXISTS messages (
     message_id INTEGER PRIMARY KEY,
     user_id INTEGER NOT NULL,
     channel_id INTEGER NOT NULL,
     is_ranked BOOLEAN NOT NULL,
-    timestamp DATETIME NOT NULL,
+    timestamp INTEGER NOT NULL,  -- epoch milliseconds (UTC)
     points REAL DEFAULT 1,
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
 -- Reactions table to track reactions given and received
-CREATE TABLE reactions (
+CREATE TABLE IF NOT EXISTS reactions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     message_id INTEGER NOT NULL,
     reactor_id INTEGER NOT NULL,
-    timestamp DATETIME NOT NULL,
+    timestamp INTEGER NOT NULL,  -- epoch milliseconds (UTC)
     points REAL DEFAULT 0.5,
+    emoji TEXT,  -- NULL for reactions recorded before emojis were stored
     FOREIGN KEY (message_id) REFERENCES messages(message_id),
     FOREIGN KEY (reactor_id) REFERENCES users(user_id)
 );
 
 -- Mentions table to track user mentions
-CREATE TABLE mentions (
+CREATE TABLE IF NOT EXISTS mentions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     message_id INTEGER NOT NULL,
     mentioned_user_id INTEGER NOT NULL,
-    timestamp DATETIME NOT NULL,
+    timestamp INTEGER NOT NULL,  -- epoch milliseconds (UTC)
     points REAL DEFAULT 2,
     FOREIGN KEY (message_id) REFERENCES messages(message_id),
     FOREIGN KEY (mentioned_user_id) REFERENCES users(user_id)
 );
 
 -- Weekly winners table for historical tracking
-CREATE TABLE weekly_winners (
+CREATE TABLE IF NOT EXISTS weekly_winners (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
     week_start DATE NOT NULL,
@@ -52,18 +56,96 @@ CREATE TABLE weekly_winners (
 );
 
 -- Table to track member pings
-CREATE TABLE member_pings (
+CREATE TABLE IF NOT EXISTS member_pings (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
-    timestamp DATETIME NOT NULL,
+    timestamp INTEGER NOT NULL,  -- epoch milliseconds (UTC)
     question TEXT NOT NULL,
     forced BOOLEAN DEFAULT FALSE,  -- Track if it was a manual !ping
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
+-- Per-user daily score rollup, kept in sync with messages, reactions and mentions
+CREATE TABLE IF NOT EXISTS user_daily_scores (
+    user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    message_points REAL NOT NULL DEFAULT 0,
+    reaction_points REAL NOT NULL DEFAULT 0,
+    mention_points REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day),
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- Schema version and schema.sql fingerprint, maintained by migrations.py
+CREATE TABLE IF NOT EXISTS schema_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    updated_at INTEGER NOT NULL  -- epoch milliseconds (UTC)
+);
+
+-- Key/value settings describing the database itself
+CREATE TABLE IF NOT EXISTS db_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+-- Newest message ID backfilled per channel, so interrupted backfills resume
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    channel_id INTEGER PRIMARY KEY,
+    last_message_id INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL  -- epoch milliseconds (UTC)
+);
+
+-- Raw activity older than the retention window, compacted per user, channel and day.
+-- Reactions and mentions take the channel of their message, or 0 if it wasn't stored.
+-- ranked_points is the part of the points from ranked messages and reactions/mentions on them.
+CREATE TABLE IF NOT EXISTS activity_daily (
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    ranked_messages INTEGER NOT NULL DEFAULT 0,
+    reactions INTEGER NOT NULL DEFAULT 0,
+    mentions INTEGER NOT NULL DEFAULT 0,
+    message_points REAL NOT NULL DEFAULT 0,
+    reaction_points REAL NOT NULL DEFAULT 0,
+    mention_points REAL NOT NULL DEFAULT 0,
+    ranked_points REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, channel_id, day),
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- One row per closed calendar week (Monday to Sunday, UTC). A week is closed at most once.
+CREATE TABLE IF NOT EXISTS weekly_closes (
+    week_start DATE PRIMARY KEY,  -- the Monday
+    users INTEGER NOT NULL,
+    total_points REAL NOT NULL,
+    closed_at INTEGER NOT NULL,  -- epoch milliseconds (UTC)
+    announced_at INTEGER         -- epoch milliseconds (UTC); NULL until the winner is announced
+);
+
+-- Final standings of each closed week, frozen when the week closes
+CREATE TABLE IF NOT EXISTS weekly_snapshots (
+    week_start DATE NOT NULL,
+    position INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL,  -- as it was when the week closed
+    score REAL NOT NULL,
+    PRIMARY KEY (week_start, position)
+) WITHOUT ROWID;
+
 -- Create indexes for better query performance
-CREATE INDEX idx_messages_user ON messages(user_id);
-CREATE INDEX idx_messages_timestamp ON messages(timestamp);
-CREATE INDEX idx_reactions_message ON reactions(message_id);
-CREATE INDEX idx_mentions_message ON mentions(message_id);
-CREATE INDEX idx_weekly_winners_date ON weekly_winners(week_start, week_end);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+-- Natural keys: a replayed gateway event can't add a reaction or mention twice
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reactions_message_reactor_emoji ON reactions(message_id, reactor_id, emoji);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mentions_message_user ON mentions(message_id, mentioned_user_id);
+CREATE INDEX IF NOT EXISTS idx_reactions_timestamp ON reactions(timestamp);
+CREATE INDEX IF NOT EXISTS idx_mentions_timestamp ON mentions(timestamp);
+CREATE INDEX IF NOT EXISTS idx_member_pings_timestamp ON member_pings(timestamp);
+CREATE INDEX IF NOT EXISTS idx_member_pings_user ON member_pings(user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_weekly_winners_date ON weekly_winners(week_start, week_end);
+CREATE INDEX IF NOT EXISTS idx_user_daily_scores_day ON user_daily_scores(day);
+CREATE INDEX IF NOT EXISTS idx_activity_daily_day ON activity_daily(day);
+CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users(last_message_at, last_pinged_at);
\ No newline at end of file
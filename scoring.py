@@ -0,0 +1,161 @@
+"""Point values for messages, reactions and mentions.
+
+A ScoringRules value is compiled into a Scorer, which scores events one at a
+time at ingest and also renders the same rules as SQL expressions so
+Database.rescore() can recompute stored history set-wise. Both paths multiply
+in the same order (base * channel * hour), so they agree to the last bit.
+"""
+import functools
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from backports.zoneinfo import ZoneInfo
+
+# SQL function Scorer.register() adds: local hour (0-23) of an epoch ms timestamp
+LOCAL_HOUR_SQL = 'binky_local_hour'
+
+_EPOCH = datetime(1970, 1, 1)
+_QUARTER_HOUR = timedelta(minutes=15)
+
+
+class ScoringRules(NamedTuple):
+    ranked_message: float = 1.5
+    social_message: float = 1.0
+    # Points for a user's 1st, 2nd, ... reaction on the same message; the last value repeats
+    reactions: Tuple[float, ...] = (0.5, 0.2)
+    mention: float = 2.0
+    # Mentions scored per message, in the order they appear; None for no cap
+    mention_cap: Optional[int] = None
+    # Multipliers by channel ID (reactions and mentions use their message's channel)
+    channel_multipliers: Mapping[int, float] = {}
+    # Multipliers by hour of the message, reaction or mention, in timezone
+    hour_multipliers: Mapping[int, float] = {}
+    # IANA name of the timezone hour_multipliers are in, e.g. America/Los_Angeles
+    timezone: str = 'UTC'
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ScoringRules':
+        """Build rules from JSON-style data, e.g. a guild's "scoring" entry in guilds.json."""
+        unknown = set(data) - set(cls._fields)
+        if unknown:
+            raise ValueError(f"Unknown scoring rules: {', '.join(sorted(unknown))}")
+        rules = dict(data)
+        if 'reactions' in rules:
+            rules['reactions'] = tuple(float(p) for p in rules['reactions'])
+            if not rules['reactions']:
+                raise ValueError("reactions needs at least one value")
+        for name in ('channel_multipliers', 'hour_multipliers'):
+            if name in rules:
+                rules[name] = {int(k): float(v) for k, v in rules[name].items()}
+        if any(not 0 <= hour < 24 for hour in rules.get('hour_multipliers', {})):
+            raise ValueError("hour_multipliers keys must be hours 0-23")
+        if 'timezone' in rules:
+            try:
+                ZoneInfo(rules['timezone'])
+            except (KeyError, ValueError):
+                raise ValueError(f"Unknown timezone: {rules['timezone']}") from None
+        return cls(**rules)
+
+
+DEFAULT_RULES = ScoringRules()
+
+# Scores at or below this are float residue from removed reactions, not points
+SCORE_EPSILON = 1e-9
+
+
+def load_rules(path: str) -> ScoringRules:
+    """Read scoring rules from a JSON file with the same keys as ScoringRules."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return ScoringRules.from_dict(json.load(f))
+
+
+def _case(expression: str, values: Mapping[int, float]) -> str:
+    """SQL CASE mapping integer keys to multipliers, 1.0 otherwise."""
+    if not values:
+        return '1.0'
+    whens = ' '.join(f"WHEN {key} THEN {value!r}" for key, value in sorted(values.items()))
+    return f"(CASE {expression} {whens} ELSE 1.0 END)"
+
+
+class Scorer:
+    """ScoringRules compiled for per-event scoring and for SQL recomputation."""
+
+    def __init__(self, rules: ScoringRules = DEFAULT_RULES):
+        self.rules = rules
+        self._channels = dict(rules.channel_multipliers)
+        self._hours: List[float] = [rules.hour_multipliers.get(hour, 1.0) for hour in range(24)]
+        # None for UTC, where the local hour is just the timestamp's hour
+        self.zone = None if rules.timezone == 'UTC' else ZoneInfo(rules.timezone)
+        # Reactions only need their message's channel when channels are weighted
+        self.needs_channel = bool(self._channels)
+        self._quarter_hours = functools.lru_cache(maxsize=4096)(self._quarter_hour)
+
+    def _quarter_hour(self, quarter: int) -> int:
+        """Local hour of the quarter hour starting quarter * 15 minutes after the epoch."""
+        # Offsets and DST changes fall on quarter hours, so the whole quarter shares one local hour
+        return (_EPOCH + quarter * _QUARTER_HOUR).replace(tzinfo=timezone.utc).astimezone(self.zone).hour
+
+    def local_hour(self, timestamp: datetime) -> int:
+        """Hour (0-23) of a naive UTC timestamp in the rules' timezone."""
+        if self.zone is None:
+            return timestamp.hour
+        return self._quarter_hours((timestamp - _EPOCH) // _QUARTER_HOUR)
+
+    def _local_hour_ms(self, epoch_ms: Optional[int]) -> Optional[int]:
+        return None if epoch_ms is None else self._quarter_hours(epoch_ms // 900000)
+
+    def _multiplier(self, channel_id: Optional[int], timestamp: datetime) -> Tuple[float, float]:
+        return self._channels.get(channel_id or 0, 1.0), self._hours[self.local_hour(timestamp)]
+
+    def message(self, channel_id: int, is_ranked: bool, timestamp: datetime) -> float:
+        base = self.rules.ranked_message if is_ranked else self.rules.social_message
+        channel, hour = self._multiplier(channel_id, timestamp)
+        return base * channel * hour
+
+    def reaction(self, nth: int, channel_id: Optional[int], timestamp: datetime) -> float:
+        """Points for a user's nth (0-based) reaction on a message."""
+        schedule = self.rules.reactions
+        base = schedule[min(nth, len(schedule) - 1)]
+        channel, hour = self._multiplier(channel_id, timestamp)
+        return base * channel * hour
+
+    def mention(self, nth: int, channel_id: Optional[int], timestamp: datetime) -> float:
+        """Points for the nth (0-based) mention in a message."""
+        cap = self.rules.mention_cap
+        base = self.rules.mention if cap is None or nth < cap else 0.0
+        channel, hour = self._multiplier(channel_id, timestamp)
+        return base * channel * hour
+
+    # SQL versions. Arguments are SQL expressions: nth is 0-based, channel may be
+    # NULL for reactions and mentions on unknown messages, hour is from hour_sql().
+
+    def hour_sql(self, epoch_ms: str, utc_hour: str) -> str:
+        """SQL for the local hour, given SQL for the epoch ms and the UTC hour of a timestamp.
+
+        Outside UTC this calls LOCAL_HOUR_SQL, so register() the scorer on the connection first.
+        """
+        return utc_hour if self.zone is None else f"{LOCAL_HOUR_SQL}({epoch_ms})"
+
+    def register(self, conn) -> None:
+        """Add LOCAL_HOUR_SQL for this scorer's timezone to a sqlite3 connection."""
+        conn.create_function(LOCAL_HOUR_SQL, 1, self._local_hour_ms, deterministic=True)
+
+    def message_sql(self, is_ranked: str, channel: str, hour: str) -> str:
+        base = f"(CASE WHEN {is_ranked} THEN {self.rules.ranked_message!r} ELSE {self.rules.social_message!r} END)"
+        return f"{base} * {_case(f'COALESCE({channel}, 0)', self._channels)} * {_case(hour, self._hours_map())}"
+
+    def reaction_sql(self, nth: str, channel: str, hour: str) -> str:
+        schedule = self.rules.reactions
+        whens = ' '.join(f"WHEN {i} THEN {points!r}" for i, points in enumerate(schedule[:-1]))
+        base = f"(CASE {nth} {whens} ELSE {schedule[-1]!r} END)" if whens else repr(schedule[-1])
+        return f"{base} * {_case(f'COALESCE({channel}, 0)', self._channels)} * {_case(hour, self._hours_map())}"
+
+    def mention_sql(self, nth: str, channel: str, hour: str) -> str:
+        cap = self.rules.mention_cap
+        mention = repr(self.rules.mention)
+        base = mention if cap is None else f"(CASE WHEN {nth} < {cap} THEN {mention} ELSE 0.0 END)"
+        return f"{base} * {_case(f'COALESCE({channel}, 0)', self._channels)} * {_case(hour, self._hours_map())}"
+
+    def _hours_map(self) -> Dict[int, float]:
+        return {hour: value for hour, value in enumerate(self._hours) if value != 1.0}
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A fresh on-disk database, so the reader pool is used as in production."""
+    database = Database(str(tmp_path / 'binky.db'))
+    yield database
+    database.close()
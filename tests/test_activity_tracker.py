@@ -0,0 +1,67 @@
+"""Background loops and pings: slow databases and failing writes don't stop them."""
+import asyncio
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('discord')
+
+from activity_tracker import ActivityTracker, PingManager
+from async_database import AsyncDatabase
+from benchmarks.stubs import StubBot, StubChannel
+from dispatcher import Dispatcher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    # PingManager reads questions.txt from the working directory
+    monkeypatch.chdir(ROOT)
+
+
+def blocked(adb: AsyncDatabase) -> threading.Event:
+    """Occupy every worker of adb until the returned event is set."""
+    release = threading.Event()
+    for _ in range(adb._executor._max_workers):
+        adb._executor.submit(release.wait)
+    return release
+
+
+def test_loops_survive_database_timeouts(db):
+    async def main():
+        adb = AsyncDatabase(db, max_workers=1, timeout=0.05)
+        channel = StubChannel(9, 'general')
+        tracker = ActivityTracker(StubBot([channel]), db, 9, Dispatcher(), adb)
+        pings = PingManager(db, StubBot([channel]), 9, Dispatcher(), adb)
+        pings._is_active_hours = lambda: True
+        release = blocked(adb)
+        try:
+            # Loop bodies must log and return, not raise (which would stop the loop)
+            await tracker.process_weekly_winner.coro(tracker)
+            await pings.ping_check_loop.coro(pings)
+        finally:
+            release.set()
+            adb.close()
+
+    asyncio.run(main())
+
+
+def test_delivered_ping_counts_even_if_recording_fails(db):
+    async def main():
+        channel = StubChannel(9, 'general')
+        adb = AsyncDatabase(db)
+        pings = PingManager(db, StubBot([channel]), 9, Dispatcher(), adb)
+
+        def fail(*args):
+            raise RuntimeError("disk full")
+        db.record_ping = fail
+        try:
+            assert await pings.ping_member(1, 'user')
+        finally:
+            adb.close()
+        return channel
+
+    channel = asyncio.run(main())
+    assert len(channel.sent) == 1
@@ -0,0 +1,29 @@
+"""Leaderboards over raw and compacted history."""
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from analytics import AnalyticsEngine
+from models import MentionEvent, MessageEvent, ReactionEvent, UserEvent
+
+
+def test_compaction_keeps_ranked_and_social_points(db):
+    old = datetime.utcnow() - timedelta(days=30)
+    db.record_batch([
+        UserEvent(1, 'a'), UserEvent(2, 'b'), UserEvent(3, 'c'),
+        MessageEvent(1, 1, 10, True, old),    # ranked channel
+        MessageEvent(2, 3, 20, False, old),   # social channel
+        ReactionEvent(1, 2, old, 10, '👍'),
+        MentionEvent(1, 2, old),
+        ReactionEvent(2, 1, old, 20, '👍'),
+    ])
+    engine = AnalyticsEngine(db, max_age=0)
+    before = {ranked: engine.leaderboard(None, ranked=ranked) for ranked in (True, False)}
+
+    assert db.compact_activity(7) > 0
+    after = {ranked: engine.leaderboard(None, ranked=ranked) for ranked in (True, False)}
+
+    assert before[True] == [(2, 'b', 2.5), (1, 'a', 1.5)]
+    assert after == before
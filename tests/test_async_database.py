@@ -0,0 +1,45 @@
+"""AsyncDatabase timeouts: reads can be abandoned, writes always run."""
+import asyncio
+import threading
+
+import pytest
+
+from async_database import AsyncDatabase
+
+
+def test_queued_write_runs_after_its_caller_gives_up(db):
+    async def main():
+        adb = AsyncDatabase(db, max_workers=1, timeout=0.05)
+        busy = threading.Event()
+        # Keep the only worker busy so everything below queues behind it
+        blocker = asyncio.get_event_loop().run_in_executor(adb._executor, busy.wait)
+        write = asyncio.ensure_future(adb.record_ping(1, 'question'))
+        await asyncio.sleep(0.05)
+        write.cancel()
+        with pytest.raises(asyncio.TimeoutError):
+            await adb.get_last_ping_time()
+        busy.set()
+        await blocker
+        adb.close()
+
+    asyncio.run(main())
+    assert db.get_last_ping_time() is not None
+
+
+def test_abandoned_read_is_skipped(db):
+    calls = []
+
+    async def main():
+        adb = AsyncDatabase(db, max_workers=1, timeout=0.05)
+        busy = threading.Event()
+        blocker = asyncio.get_event_loop().run_in_executor(adb._executor, busy.wait)
+        original = db.get_last_ping_time
+        db.get_last_ping_time = lambda: calls.append(True) or original()
+        with pytest.raises(asyncio.TimeoutError):
+            await adb.get_last_ping_time()
+        busy.set()
+        await blocker
+        adb.close()
+
+    asyncio.run(main())
+    assert not calls
@@ -0,0 +1,85 @@
+"""Backfill against an in-process fake channel: resume, skipping stored messages, failures."""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+discord = pytest.importorskip('discord')
+
+from backfill import backfill_channel, backfill_channels
+from benchmarks.stubs import StubChannel, StubMessage, StubUser
+from database import Database
+from models import MessageEvent, UserEvent
+
+START = datetime(2026, 9, 1)
+CHANNEL_ID = 500
+FIRST_ID = 10_000
+
+
+def make_channel(count: int, **kwargs) -> StubChannel:
+    channel = StubChannel(CHANNEL_ID, 'ranked', **kwargs)
+    users = [StubUser(1000 + i, f"user{i}") for i in range(5)]
+    for i in range(count):
+        message = StubMessage(FIRST_ID + i, users[i % 5], channel, START + timedelta(minutes=i))
+        message.react(users[(i + 1) % 5], '🔥')
+        channel.messages.append(message)
+    return channel
+
+
+def http_error() -> Exception:
+    return discord.HTTPException(SimpleNamespace(status=500, reason='Server Error'), 'history failed')
+
+
+def count(db: Database, table: str) -> int:
+    with db.reader() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_failure_keeps_partial_count_and_resumes(db):
+    channel = make_channel(60, history_error=(25, http_error()))
+
+    written = asyncio.run(backfill_channel(db, channel, True, batch_size=10))
+
+    # The two full batches before the failure are stored and checkpointed
+    assert written == 20
+    assert count(db, 'messages') == 20
+    assert db.get_backfill_checkpoint(CHANNEL_ID) == FIRST_ID + 19
+
+    channel.history_error = None
+    channel.fetched = 0
+    assert asyncio.run(backfill_channel(db, channel, True, batch_size=10)) == 40
+    assert channel.fetched == 40
+    assert count(db, 'messages') == 60
+    assert count(db, 'reactions') == 60
+
+
+def test_channels_report_partial_progress(db):
+    channel = make_channel(60, history_error=(25, http_error()))
+    assert asyncio.run(backfill_channels(db, [channel], {CHANNEL_ID}, batch_size=10)) == 20
+
+
+def test_skips_messages_already_stored(db):
+    channel = make_channel(60)
+    live = channel.messages[:30]
+    db.record_batch([event for m in live for event in (
+        UserEvent(m.author.id, str(m.author)),
+        MessageEvent(m.id, m.author.id, CHANNEL_ID, True, m.created_at),
+    )])
+
+    since = START - timedelta(days=1)
+    assert asyncio.run(backfill_channel(db, channel, True, since=since, batch_size=10)) == 30
+    assert count(db, 'messages') == 60
+    # Stored messages are skipped along with their reactions, so nothing is scored twice
+    assert count(db, 'reactions') == 30
+    assert sum(score for _, _, score in db.get_scores(since.date())) == pytest.approx(60 * 1.5 + 30 * 0.5)
+
+
+def test_first_run_starts_after_newest_stored_message(db):
+    channel = make_channel(60)
+    newest = channel.messages[29]
+    db.record_message(newest.id, newest.author.id, CHANNEL_ID, True, newest.created_at)
+
+    assert asyncio.run(backfill_channel(db, channel, True, batch_size=10)) == 30
+    assert channel.fetched == 30
+    assert db.get_backfill_checkpoint(CHANNEL_ID) == FIRST_ID + 59
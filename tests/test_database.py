@@ -0,0 +1,43 @@
+"""Database transactions and queries."""
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from models import MessageEvent, ReactionEvent, ReactionRemoveEvent, UserEvent
+
+
+def test_failed_commit_rolls_back(db):
+    db._writer.execute("PRAGMA foreign_keys=ON")
+    committed = []
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.writer() as conn:
+            db._on_commit(lambda: committed.append(True))
+            # A deferred foreign key violation makes COMMIT itself fail
+            conn.execute("PRAGMA defer_foreign_keys=ON")
+            conn.execute("""
+                INSERT INTO messages (message_id, user_id, channel_id, is_ranked, timestamp, points)
+                VALUES (1, 999, 1, 1, 0, 1.5)
+            """)
+    assert not db._writer.in_transaction
+    assert not committed
+
+    # The next transaction starts fresh and commits
+    with db.writer() as conn:
+        conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'user')")
+    with db.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+
+
+def test_scores_skip_float_residue(db):
+    day = datetime(2026, 9, 1, 12)
+    db.record_batch([UserEvent(1, 'author'), UserEvent(2, 'reactor'),
+                     MessageEvent(1, 1, 5, True, day)])
+    # Points that don't cancel exactly in floating point
+    for _ in range(3):
+        db.record_batch([ReactionEvent(1, 2, day, emoji='👍')])
+        db.record_batch([ReactionRemoveEvent(1, 2, day, emoji='👍')])
+    with db.writer() as conn:
+        conn.execute("UPDATE user_daily_scores SET reaction_points = reaction_points + 1e-12 WHERE user_id = 2")
+    assert [user_id for user_id, _, _ in db.get_scores(day.date())] == [1]
@@ -0,0 +1,107 @@
+"""Dispatcher against StubChannel: coalescing, pacing, rate limits and giving up."""
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.stubs import StubChannel, StubHTTPError
+from dispatcher import MAX_MESSAGE_LENGTH, Dispatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_queued_messages_are_coalesced():
+    async def main():
+        channel = StubChannel(1, 'general')
+        dispatcher = Dispatcher()
+        futures = [dispatcher.send(channel, f"line {i}") for i in range(5)]
+        results = await asyncio.gather(*futures)
+        return channel, results
+
+    channel, results = run(main())
+    # All five were queued before the channel's worker ran, so they went out as one
+    assert [content for _, content in channel.sent] == ["line 0\nline 1\nline 2\nline 3\nline 4"]
+    assert all(result is results[0] for result in results)
+
+
+def test_coalescing_respects_the_length_limit():
+    async def main():
+        channel = StubChannel(1, 'general')
+        dispatcher = Dispatcher()
+        await asyncio.gather(*[dispatcher.send(channel, 'x' * 800) for i in range(4)])
+        return channel
+
+    channel = run(main())
+    assert all(len(content) <= MAX_MESSAGE_LENGTH for _, content in channel.sent)
+    assert sum(content.count('x') for _, content in channel.sent) == 4 * 800
+
+
+def test_sends_are_paced_by_the_channel_bucket():
+    async def main():
+        # One send per 0.05s keeps under a channel limit of one per 0.04s
+        channel = StubChannel(1, 'general', rate_limit=(1, 0.04))
+        dispatcher = Dispatcher(channel_rate=(1, 0.05))
+        started = time.monotonic()
+        for i in range(6):
+            await dispatcher.send(channel, f"message {i}")
+        return channel, time.monotonic() - started
+
+    channel, elapsed = run(main())
+    assert len(channel.sent) == 6
+    assert channel.rejected == 0
+    assert elapsed >= 0.25
+
+
+def test_rate_limit_is_retried_after_retry_after():
+    async def main():
+        channel = StubChannel(1, 'general', failures=[StubHTTPError(429, retry_after=0.1)])
+        dispatcher = Dispatcher(base_backoff=0.001)
+        started = time.monotonic()
+        await dispatcher.send(channel, "hello")
+        return channel, time.monotonic() - started
+
+    channel, elapsed = run(main())
+    assert [content for _, content in channel.sent] == ["hello"]
+    assert channel.rejected == 1
+    # The retry waited for the channel's bucket, paused for retry_after
+    assert elapsed >= 0.1
+
+
+def test_server_errors_are_retried():
+    async def main():
+        channel = StubChannel(1, 'general', failures=[StubHTTPError(500), StubHTTPError(503)])
+        dispatcher = Dispatcher(base_backoff=0.001)
+        await dispatcher.send(channel, "hello")
+        return channel
+
+    channel = run(main())
+    assert [content for _, content in channel.sent] == ["hello"]
+    assert channel.rejected == 2
+
+
+def test_forbidden_is_given_up_on_at_once():
+    async def main():
+        channel = StubChannel(1, 'general', failures=[StubHTTPError(403)])
+        dispatcher = Dispatcher(base_backoff=0.001)
+        with pytest.raises(StubHTTPError):
+            await dispatcher.send(channel, "hello")
+        # The queue carries on with the next message
+        await dispatcher.send(channel, "after")
+        return channel
+
+    channel = run(main())
+    assert channel.rejected == 1
+    assert [content for _, content in channel.sent] == ["after"]
+
+
+def test_retries_are_bounded():
+    async def main():
+        channel = StubChannel(1, 'general', failures=[StubHTTPError(500)] * 10)
+        dispatcher = Dispatcher(max_retries=2, base_backoff=0.001)
+        with pytest.raises(StubHTTPError):
+            await dispatcher.send(channel, "hello")
+        return channel
+
+    assert run(main()).rejected == 3
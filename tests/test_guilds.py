@@ -0,0 +1,57 @@
+"""GuildRouter: each guild's activity lands only in its own database."""
+import asyncio
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('discord')
+
+from benchmarks.stubs import StubBot, StubChannel, StubGuild, StubMessage, StubUser
+from dispatcher import Dispatcher
+from guilds import GuildConfig, GuildRouter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def stored_messages(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute("SELECT message_id FROM messages ORDER BY message_id")]
+    finally:
+        conn.close()
+
+
+def test_messages_are_routed_to_their_guilds_database(tmp_path, monkeypatch):
+    # PingManager reads questions.txt from the working directory
+    monkeypatch.chdir(ROOT)
+    first, second, other = StubGuild(1, 'first'), StubGuild(2, 'second'), StubGuild(3, 'unconfigured')
+    channels = [StubChannel(10, 'first-general', first), StubChannel(20, 'second-general', second),
+                StubChannel(30, 'other-general', other), StubChannel(40, 'dm')]
+    configs = [GuildConfig(1, 10, (10,), str(tmp_path / 'first.db')),
+               GuildConfig(2, 20, (), str(tmp_path / 'second.db'))]
+    author = StubUser(100, 'author')
+
+    async def main():
+        router = GuildRouter(StubBot(channels), configs, Dispatcher())
+        router.start()
+        contexts = list(router)
+        router.start()  # a reconnect must not open the databases again
+        assert list(router) == contexts and router.started
+
+        for message_id, channel in enumerate(channels, start=1000):
+            message = StubMessage(message_id, author, channel, datetime.utcnow())
+            context = router.get(message)
+            if context:
+                await context.tracker.on_message(message)
+        assert router.get(StubMessage(1, author, channels[2], datetime.utcnow())) is None
+        assert router.get(StubMessage(1, author, channels[3], datetime.utcnow())) is None
+
+        # Closing flushes each guild's ingest queue into its own file
+        router.close()
+        assert not router.started
+
+    asyncio.run(main())
+    assert stored_messages(configs[0].db_path) == [1000]
+    assert stored_messages(configs[1].db_path) == [1001]
@@ -0,0 +1,104 @@
+"""Idempotent ingest: replays are dropped and counted, re-added reactions score again."""
+import sqlite3
+from datetime import datetime
+
+from database import Database
+from metrics import EVENTS_DUPLICATE
+from models import MentionEvent, MessageEvent, ReactionEvent, ReactionRemoveEvent, UserEvent
+
+NOW = datetime(2026, 9, 1, 12)
+
+
+def activity() -> list:
+    return [
+        UserEvent(1, 'author'), UserEvent(2, 'friend'),
+        MessageEvent(10, 1, 5, True, NOW),
+        MentionEvent(10, 2, NOW),
+        ReactionEvent(10, 2, NOW, 5, '👍'),
+    ]
+
+
+def duplicates() -> dict:
+    return {name: EVENTS_DUPLICATE.labels(name).value
+            for name in ('MessageEvent', 'MentionEvent', 'ReactionEvent', 'ReactionRemoveEvent')}
+
+
+def totals(db: Database) -> dict:
+    with db.reader() as conn:
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ('messages', 'mentions', 'reactions')}
+    return {'counts': counts, 'scores': db.get_scores(NOW.date())}
+
+
+def test_replayed_batch_is_dropped_and_counted(db):
+    db.record_batch(activity())
+    expected = totals(db)
+    before = duplicates()
+
+    db.record_batch(activity())  # caught by the recent-event filter
+
+    assert totals(db) == expected
+    after = duplicates()
+    assert {name: after[name] - before[name] for name in after} == {
+        'MessageEvent': 1, 'MentionEvent': 1, 'ReactionEvent': 1, 'ReactionRemoveEvent': 0}
+
+
+def test_replay_after_restart_is_caught_by_unique_keys(tmp_path):
+    path = str(tmp_path / 'binky.db')
+    db = Database(path)
+    db.record_batch(activity())
+    expected = totals(db)
+    db.close()
+
+    # A new process remembers nothing, so the inserts themselves must refuse the replay
+    db = Database(path)
+    try:
+        before = duplicates()
+        db.record_batch(activity() + activity())
+        assert totals(db) == expected
+        assert duplicates()['MessageEvent'] - before['MessageEvent'] == 2
+    finally:
+        db.close()
+
+
+def test_removed_reaction_scores_again_when_re_added(db):
+    db.record_batch(activity())
+    scored = totals(db)
+
+    db.record_batch([ReactionRemoveEvent(10, 2, NOW, '👍')])
+    assert totals(db)['counts']['reactions'] == 0
+    db.record_batch([ReactionRemoveEvent(10, 2, NOW, '👍')])  # a replayed removal changes nothing
+
+    db.record_batch([ReactionEvent(10, 2, NOW, 5, '👍')])
+    assert totals(db) == scored
+
+
+def test_migration_removes_duplicate_mentions_and_their_points(tmp_path):
+    path = str(tmp_path / 'binky.db')
+    db = Database(path)
+    db.record_batch(activity())
+    expected = totals(db)
+    db.close()
+
+    # An old database: no unique key on mentions, and a replayed mention stored and scored twice
+    conn = sqlite3.connect(path)
+    conn.execute("DROP INDEX idx_mentions_message_user")
+    conn.execute("""
+        INSERT INTO mentions (message_id, mentioned_user_id, timestamp, points)
+        SELECT message_id, mentioned_user_id, timestamp, points FROM mentions
+    """)
+    conn.execute("""
+        UPDATE user_daily_scores SET mention_points = mention_points * 2 WHERE user_id = 2
+    """)
+    conn.execute("UPDATE schema_version SET version = 8")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    try:
+        assert totals(db) == expected
+        rollup = db.get_scores(NOW.date())
+        db.rebuild_daily_scores()
+        assert db.get_scores(NOW.date()) == rollup
+    finally:
+        db.close()
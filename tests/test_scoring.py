@@ -0,0 +1,37 @@
+"""Hour multipliers in a local timezone, per event and in the SQL used by rescore."""
+from datetime import datetime, timedelta
+
+from database import Database
+from models import MessageEvent
+from scoring import DEFAULT_RULES, Scorer, ScoringRules
+
+RULES = ScoringRules.from_dict({'hour_multipliers': {'20': 2.0}, 'timezone': 'America/Los_Angeles'})
+
+
+def test_local_hour_follows_daylight_saving():
+    scorer = Scorer(RULES)
+    # 20:00 in Los Angeles is 03:00 UTC in summer (PDT) and 04:00 UTC in winter (PST)
+    assert scorer.local_hour(datetime(2026, 7, 1, 3, 30)) == 20
+    assert scorer.local_hour(datetime(2026, 12, 1, 4, 30)) == 20
+    assert scorer.message(1, True, datetime(2026, 12, 1, 4, 30)) == 3.0
+    assert scorer.message(1, True, datetime(2026, 12, 1, 3, 30)) == 1.5
+
+
+def test_rescore_matches_ingest(tmp_path):
+    db = Database(str(tmp_path / 'binky.db'), rules=DEFAULT_RULES)
+    try:
+        # Every quarter hour across the November DST change
+        start = datetime(2026, 10, 30)
+        db.record_batch([MessageEvent(i + 1, 7, 1, True, start + timedelta(minutes=15 * i)) for i in range(1000)])
+        db.set_rules(RULES)
+        assert db.rescore() > 0
+        scorer = Scorer(RULES)
+        with db.reader() as conn:
+            for message_id, points in conn.execute("SELECT message_id, points FROM messages"):
+                timestamp = start + timedelta(minutes=15 * (message_id - 1))
+                assert points == scorer.message(1, True, timestamp)
+        # Events ingested under the new rules already carry the points rescore computes
+        db.record_batch([MessageEvent(5000 + i, 7, 1, True, start + timedelta(minutes=7 * i)) for i in range(1000)])
+        assert db.rescore() == 0
+    finally:
+        db.close()